@@ -0,0 +1,30 @@
+"""
+Benchmarks of the bot, run them from the root of the project, like:
+    python -m benchmarks.cache_stress
+"""
+
+import os
+import sys
+import tempfile
+
+# the settings that the bot needs to start, the benchmarks do not connect to telegram
+FAKE_SETTINGS = {
+    "TELEGRAM_API_ID": "1",
+    "TELEGRAM_API_HASH": "x",
+    "TELEGRAM_BOT_TOKEN": "x",
+    "ADMINS": "[1]",
+    "LIMIT_SPAM": "20",
+    "ADMIN_TO_UPDATE_OF_PAYMENT": "1",
+}
+
+
+def setup(*, temp_database: bool = True):
+    """
+    Prepare the environment of a benchmark, before it imports the modules of the bot
+    :param temp_database: work in a temporary directory, the database file is created there
+    """
+    for key, value in FAKE_SETTINGS.items():
+        os.environ.setdefault(key, value)
+    sys.path.insert(0, os.getcwd())
+    if temp_database:
+        os.chdir(tempfile.mkdtemp())
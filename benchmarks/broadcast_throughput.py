@@ -0,0 +1,105 @@
+"""
+Broadcast throughput benchmark, the old one-at-a-time loop against `tg.broadcast.Broadcast`
+
+A fake client answers every send after LATENCY seconds, and enforces a limit of LIMIT sends
+per second like telegram does: a send over the limit gets a FloodWait of FLOOD_WAIT seconds.
+Some chats blocked the bot. The engine runs with the default rate, and with a rate that is too
+high, to show how it slows down on FloodWait.
+Run from the root of the project:
+    python -m benchmarks.broadcast_throughput
+"""
+
+import asyncio
+import random
+import time
+
+from benchmarks import setup
+
+RECIPIENTS = 600
+LATENCY = 0.06  # seconds, a round-trip to telegram
+LIMIT = 30  # sends per second allowed by the fake telegram
+FLOOD_WAIT = 2  # seconds
+BLOCKED_RATIO = 0.05
+
+setup(temp_database=False)
+
+from pyrogram import errors  # noqa: E402
+
+from tg.broadcast import Broadcast  # noqa: E402
+
+
+class FakeClient:
+    """Answer the sends like telegram, with a latency and a FloodWait over the limit"""
+
+    def __init__(self):
+        self.sends = []  # the times of the accepted sends, in the last second
+        self.flood_waits = 0
+        self.blocked = set(
+            random.Random(1).sample(range(RECIPIENTS), int(RECIPIENTS * BLOCKED_RATIO))
+        )
+
+    async def send(self, chat_id: int) -> int:
+        now = time.monotonic()
+        self.sends = [sent for sent in self.sends if now - sent < 1]
+        if len(self.sends) >= LIMIT:
+            self.flood_waits += 1
+            raise errors.FloodWait(value=FLOOD_WAIT)
+        self.sends.append(now)
+        await asyncio.sleep(LATENCY)
+        if chat_id in self.blocked:
+            raise errors.UserIsBlocked()
+        return chat_id
+
+
+async def recipients():
+    for chat_id in range(RECIPIENTS):
+        yield chat_id
+
+
+async def old_loop(client: FakeClient) -> tuple[int, int]:
+    """The loop of `send_broadcast` before the engine"""
+    sent = failed = count = 0
+    async for chat_id in recipients():
+        if count > 40:
+            count = 0
+            await asyncio.sleep(3)
+        try:
+            await client.send(chat_id)
+            sent += 1
+            count += 1
+            await asyncio.sleep(0.05)
+        except errors.FloodWait as e:
+            await asyncio.sleep(e.value)
+        except errors.UserIsBlocked:
+            failed += 1
+    return sent, failed
+
+
+async def engine(client: FakeClient, **kwargs) -> tuple[int, int]:
+    async def on_sent(_, __):
+        pass
+
+    async def on_error(_, __):
+        pass
+
+    sender = Broadcast(send=client.send, on_sent=on_sent, on_error=on_error, **kwargs)
+    await sender.run(recipients())
+    return sender.sent, sender.failed
+
+
+def run(title: str, broadcast, **kwargs):
+    client = FakeClient()
+    start = time.perf_counter()
+    sent, failed = asyncio.run(broadcast(client, **kwargs))
+    elapsed = time.perf_counter() - start
+    print(
+        f"{title:<22} {(sent + failed) / elapsed:6.1f} chats/s  {elapsed:6.1f} s  "
+        f"sent: {sent}, failed: {failed}, lost: {RECIPIENTS - sent - failed}, "
+        f"FloodWaits: {client.flood_waits}"
+    )
+
+
+if __name__ == "__main__":
+    run("old loop", old_loop)
+    run("engine (default rate)", engine)
+    run("engine (rate 60/s)", engine, rate=60)
@@ -0,0 +1,44 @@
+"""
+Microbenchmark of the cache id construction of `data.cache_memory.MemoryCache`
+
+Compares the cache id that was built on every call (a dict comprehension, ``tuple(kwargs.items())``
+and a nested tuple) with the builder that is prepared once, when the function is decorated.
+Run from the root of the project:
+    python -m benchmarks.cache_key
+"""
+
+import timeit
+
+from data.cache_memory import MemoryCache
+
+NUMBER = 1_000_000
+
+
+def old_get_cache_id(params, *args, **kwargs):
+    """The cache id as it was built before the builders, for the comparison"""
+    _kwargs = (
+        {k: kwargs[k] for k in (params if not isinstance(params, str) else (params,))}
+        if params is not None
+        else kwargs
+    )
+    return MemoryCache.build_cache_id(*args if params is not None else (), **_kwargs)
+
+
+def compare(title: str, params, kwargs: dict):
+    build = MemoryCache._cache_id_builder(params)
+    old = timeit.timeit(lambda: old_get_cache_id(params, **kwargs), number=NUMBER)
+    new = timeit.timeit(lambda: build((), kwargs), number=NUMBER)
+    print(
+        f"{title:<24} old: {old / NUMBER * 1e9:6.0f} ns  "
+        f"new: {new / NUMBER * 1e9:6.0f} ns  ({old / new:.1f}x)"
+    )
+
+
+if __name__ == "__main__":
+    compare("params='tg_id'", "tg_id", {"tg_id": 123456789})
+    compare(
+        "params=('from', 'tg_id')",
+        ("keyboard_from", "tg_id"),
+        {"keyboard_from": "menu", "tg_id": 123456789},
+    )
+    compare("params=None", None, {"tg_id": 123456789})
@@ -0,0 +1,112 @@
+"""
+Stress benchmark for the thread-safe mode of `data.cache_memory.MemoryCache`
+
+Threads (like the stats threads of the bot) and the event loop (like the handlers) hammer
+the same cache with get / set / delete / invalidate_tag / clear, then the internal state is checked.
+Run from the root of the project:
+    python -m benchmarks.cache_stress
+"""
+
+import asyncio
+import random
+import threading
+import time
+
+from data.cache_memory import MemoryCache
+
+THREADS = 8
+OPERATIONS = 50_000
+USERS = 2_000
+MAXSIZE = 1_000
+
+
+def build_cache(thread_safe: bool) -> MemoryCache:
+    cache = MemoryCache(thread_safe=thread_safe)
+    cache.configure("get_user", maxsize=MAXSIZE, ttl=0.5)
+    cache.configure("get_keyboard", maxsize=MAXSIZE, ttl=0.5)
+    return cache
+
+
+def hammer(cache: MemoryCache, seed: int):
+    """Run random operations on the cache, like the repository does"""
+    rnd = random.Random(seed)
+    for _ in range(OPERATIONS):
+        tg_id = rnd.randrange(USERS)
+        tag = f"user:{tg_id}"
+        op = rnd.random()
+        if op < 0.6:
+            cache.get("get_user", tg_id)
+        elif op < 0.85:
+            cache.set("get_user", tg_id, tg_id, tags=(tag,))
+            cache.set("get_keyboard", tg_id, tg_id, tags=(tag,))
+        elif op < 0.95:
+            cache.invalidate_tag(tag)
+        elif op < 0.9999:
+            cache.delete("get_user", tg_id)
+        else:
+            cache.clear()
+
+
+async def hammer_from_loop(cache: MemoryCache, seed: int):
+    """Run the handlers' operations on the event loop, yielding between the batches"""
+    rnd = random.Random(seed)
+    for _ in range(OPERATIONS // 100):
+        await asyncio.sleep(0)
+        for _ in range(100):
+            tg_id = rnd.randrange(USERS)
+            if rnd.random() < 0.7:
+                cache.get("get_user", tg_id)
+            else:
+                cache.set("get_user", tg_id, tg_id, tags=(f"user:{tg_id}",))
+
+
+def check(cache: MemoryCache) -> list[str]:
+    """Check that the tags index and the data agree and the limits are kept"""
+    errors = []
+    for name, namespace in cache._cache.items():
+        if len(namespace.data) > MAXSIZE:
+            errors.append(f"{name}: {len(namespace.data)} items above maxsize")
+        for cache_id, (_, _, tags) in namespace.data.items():
+            for tag in tags:
+                if (name, cache_id) not in cache._tags.get(tag, ()):
+                    errors.append(f"{name}:{cache_id} is missing from tag {tag}")
+    for tag, items in cache._tags.items():
+        for name, cache_id in items:
+            entry = cache._cache[name].data.get(cache_id)
+            if entry is None or tag not in entry[2]:
+                errors.append(f"tag {tag} points to a dropped item {name}:{cache_id}")
+    return errors
+
+
+def run(thread_safe: bool):
+    cache = build_cache(thread_safe)
+    crashes = []
+
+    def target(seed):
+        try:
+            hammer(cache, seed)
+        except Exception as e:  # the unsafe mode may break in the middle
+            crashes.append(repr(e))
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    asyncio.run(hammer_from_loop(cache, seed=THREADS))
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    ops = THREADS * OPERATIONS + OPERATIONS
+    errors = check(cache)
+    print(
+        f"thread_safe={thread_safe}: {ops / elapsed:,.0f} ops/s, "
+        f"{len(crashes)} crashed workers, {len(errors)} inconsistencies"
+    )
+    for error in (crashes + errors)[:5]:
+        print(f"    {error}")
+
+
+if __name__ == "__main__":
+    run(thread_safe=False)
+    run(thread_safe=True)
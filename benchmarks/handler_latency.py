@@ -0,0 +1,125 @@
+"""
+Handler latency benchmark, the sync repository on the event loop against the async repository
+
+Updates arrive at a steady rate. Every update looks up the user language, like the handlers do,
+some users are not cached yet, and some updates write to the database (a language change).
+The latency of an update is measured from its arrival time, so time spent waiting for the
+event loop is counted too. Every commit is slowed down by SLOW_DISK, like a busy disk.
+Run from the root of the project (a temporary database is used):
+    python -m benchmarks.handler_latency
+"""
+
+import asyncio
+import datetime
+import random
+import statistics
+import time
+
+from benchmarks import setup
+
+UPDATES = 3_000
+INTERVAL = 0.001  # one update per millisecond
+USERS = 20_000
+WARM_USERS = 10_000  # the users that are cached before the run
+WRITE_RATIO = 0.02
+SLOW_DISK = 0.01  # seconds added to every commit, like a busy disk (the sleep releases the GIL as I/O does)
+
+setup()  # the database file is created in a temporary directory
+
+from sqlalchemy import event  # noqa: E402
+
+from db import repository, async_repository, tables, migrations  # noqa: E402
+
+
+@event.listens_for(tables.engine, "commit")
+def slow_disk(_):
+    time.sleep(SLOW_DISK)
+
+
+def fill_database():
+    with tables.get_session() as session:
+        session.execute(
+            tables.User.__table__.insert(),
+            [
+                dict(
+                    tg_id=tg_id,
+                    name=f"user {tg_id}",
+                    lang="en",
+                    language_code="en",
+                    created_at=datetime.datetime.now(),
+                    active=True,
+                    admin=False,
+                )
+                for tg_id in range(USERS)
+            ],
+        )
+        session.commit()
+
+
+def warm_cache():
+    repository.cache.clear()
+    for tg_id in range(WARM_USERS):
+        repository.get_user(tg_id=tg_id)
+
+
+async def sync_handler(tg_id: int, write: bool):
+    repository.get_user_language(tg_id=tg_id)
+    if write:
+        repository.update_user(tg_id=tg_id, lang=random.choice(("en", "he")))
+    await asyncio.sleep(0.001)  # the reply to telegram
+
+
+async def async_handler(tg_id: int, write: bool):
+    await async_repository.get_user_language(tg_id=tg_id)
+    if write:
+        await async_repository.update_user(
+            tg_id=tg_id, lang=random.choice(("en", "he"))
+        )
+    await asyncio.sleep(0.001)  # the reply to telegram
+
+
+async def run(handler) -> list[float]:
+    rnd = random.Random(1)
+    latencies = []
+
+    async def timed(arrival: float, tg_id: int, write: bool):
+        await handler(tg_id, write)
+        latencies.append(time.perf_counter() - arrival)
+
+    tasks = []
+    start = time.perf_counter()
+    for i in range(UPDATES):
+        arrival = start + i * INTERVAL
+        delay = arrival - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(
+            asyncio.create_task(
+                timed(arrival, rnd.randrange(USERS), rnd.random() < WRITE_RATIO)
+            )
+        )
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+def report(title: str, latencies: list[float]):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies)
+    p99 = latencies[int(len(latencies) * 0.99)]
+    print(
+        f"{title:<6} p50: {p50 * 1000:7.2f} ms  p99: {p99 * 1000:7.2f} ms  "
+        f"max: {latencies[-1] * 1000:7.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    migrations.migrate()
+    fill_database()
+
+    warm_cache()
+    report("sync", asyncio.run(run(sync_handler)))
+
+    warm_cache()
+    report("async", asyncio.run(run(async_handler)))
+
+    async_repository.shutdown()
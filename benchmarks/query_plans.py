@@ -0,0 +1,110 @@
+"""
+Query plan check of the hot lookups of `db.repository`
+
+Every repository function below is called on a temporary database, its SQL is captured
+and run again with EXPLAIN QUERY PLAN, and the plan must use the expected index.
+Exits with an error when a query scans its table instead.
+Run from the root of the project (a temporary database is used):
+    python -m benchmarks.query_plans
+"""
+
+import sys
+
+from benchmarks import setup
+
+setup()  # the database file is created in a temporary directory
+
+from sqlalchemy import event  # noqa: E402
+
+from db import repository, tables, migrations  # noqa: E402
+
+# the repository call, and the index (or one of the indexes) its first query must use
+EXPECTED = [
+    (
+        "get_users_count_active",
+        lambda: repository.get_users_count_active(),
+        # both are index-only for the count, the planner picks one
+        ("ix_user_active", "ix_user_lang_active"),
+    ),
+    (
+        "get_active_users_page",
+        lambda: repository.get_active_users_page(after_id=1, limit=1_000),
+        "ix_user_active",
+    ),
+    (
+        "get_users_business_count",
+        lambda: repository.get_users_business_count(),
+        "ix_user_business_id",
+    ),
+    (
+        "get_groups_count_active",
+        lambda: repository.get_groups_count_active(),
+        "ix_group_active",
+    ),
+    (
+        "get_active_groups_page",
+        lambda: repository.get_active_groups_page(after_id=1, limit=1_000),
+        "ix_group_active",
+    ),
+    (
+        "get_messages_sent",
+        lambda: repository.get_messages_sent(sent_id="abc"),
+        "ix_message_sent_sent_id_chat_id",
+    ),
+    (
+        "get_sent_chat_ids",
+        lambda: repository.get_sent_chat_ids(sent_id="abc", chat_ids=[1, 2, 3]),
+        "ix_message_sent_sent_id_chat_id",
+    ),
+    (
+        "get_messages_to_delete_page",
+        lambda: repository.get_messages_to_delete_page(
+            sent_id="abc", after=(1, 1), limit=1_000
+        ),
+        "ix_message_sent_sent_id_chat_id",
+    ),
+    (
+        "is_message_sent_exists",
+        lambda: repository.is_message_sent_exists(sent_id="abc"),
+        "ix_message_sent_sent_id_chat_id",
+    ),
+]
+
+
+def capture(call) -> tuple[str, tuple]:
+    """Call the repository function and return its first SELECT with the parameters"""
+    statements = []
+
+    def before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    event.listen(tables.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        call()
+    finally:
+        event.remove(tables.engine, "before_cursor_execute", before_cursor_execute)
+    return statements[0]
+
+
+def query_plan(statement: str, parameters: tuple) -> list[str]:
+    connection = tables.engine.raw_connection()
+    try:
+        rows = connection.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        return [row[-1] for row in rows.fetchall()]
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    migrations.migrate()
+    failed = 0
+    for title, call, index in EXPECTED:
+        plan = query_plan(*capture(call))
+        indexes = (index,) if isinstance(index, str) else index
+        ok = any(name in line for line in plan for name in indexes)
+        failed += not ok
+        print(f"{'ok' if ok else 'FAIL':<5}{title:<30}{' | '.join(plan)}")
+    sys.exit(1 if failed else 0)
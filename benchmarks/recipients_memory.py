@@ -0,0 +1,72 @@
+"""
+Memory benchmark of the broadcast recipients, the full ORM list against the streaming iterator
+
+For every number of users, the peak memory (tracemalloc) of going over all the active users
+is measured with `repository.get_all_users_active` (every `User` object, with its joined groups)
+and with `repository.iter_active_users` (a page of projected rows at a time).
+Run from the root of the project (a temporary database is used):
+    python -m benchmarks.recipients_memory
+"""
+
+import datetime
+import time
+import tracemalloc
+
+from benchmarks import setup
+
+USERS = (10_000, 50_000, 200_000)
+
+setup()  # the database file is created in a temporary directory
+
+from db import repository, tables, migrations  # noqa: E402
+
+
+def fill_database(start: int, stop: int):
+    with tables.get_session() as session:
+        session.execute(
+            tables.User.__table__.insert(),
+            [
+                dict(
+                    tg_id=tg_id,
+                    name=f"user {tg_id}",
+                    username=f"username_{tg_id}",
+                    lang="en",
+                    language_code="en",
+                    created_at=datetime.datetime.now(),
+                    active=tg_id % 10 != 0,
+                    admin=False,
+                )
+                for tg_id in range(start, stop)
+            ],
+        )
+        session.commit()
+
+
+def measure(iterate) -> tuple[float, float, int]:
+    """Go over the recipients, return the peak memory in MiB, the seconds and the count"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = 0
+    for user in iterate():
+        count += user.tg_id is not None
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 2**20, elapsed, count
+
+
+if __name__ == "__main__":
+    migrations.migrate()
+    filled = 0
+    for users in USERS:
+        fill_database(filled, users)
+        filled = users
+        for title, iterate in (
+            ("ORM list", repository.get_all_users_active),
+            ("streaming", repository.iter_active_users),
+        ):
+            peak, elapsed, count = measure(iterate)
+            print(
+                f"{users:>8} users  {title:<10} peak: {peak:8.1f} MiB  "
+                f"time: {elapsed:6.2f} s  ({count} recipients)"
+            )
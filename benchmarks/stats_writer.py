@@ -0,0 +1,82 @@
+"""
+Stats benchmark, a thread per stats row against the batched background writer
+
+A burst of stats rows is created like the handlers do at peak, the time to enqueue them
+and the time until all of them are in the database are measured.
+Every commit is slowed down by SLOW_DISK, like a busy disk.
+Run from the root of the project (a temporary database is used):
+    python -m benchmarks.stats_writer
+"""
+
+import threading
+import time
+
+from benchmarks import setup
+
+ROWS = 2_000
+SLOW_DISK = 0.002  # seconds added to every commit, like a busy disk
+
+setup()  # the database file is created in a temporary directory
+
+from sqlalchemy import event, func, select  # noqa: E402
+
+from db import repository, tables, migrations  # noqa: E402
+from db.stats_writer import StatsWriter  # noqa: E402
+
+commits = 0
+
+
+@event.listens_for(tables.engine, "commit")
+def slow_disk(_):
+    global commits
+    commits += 1
+    time.sleep(SLOW_DISK)
+
+
+def count_stats() -> int:
+    with tables.get_session() as session:
+        return session.scalar(select(func.count()).select_from(tables.Stats))
+
+
+def thread_per_row():
+    threads = []
+    for _ in range(ROWS):
+        thread = threading.Thread(
+            target=repository.create_stats,
+            kwargs=dict(type_stats=tables.StatsType.ME, lang="en"),
+            daemon=True,
+        )
+        thread.start()
+        threads.append(thread)
+    enqueued = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return enqueued
+
+
+def batched_writer():
+    writer = StatsWriter(maxsize=ROWS, batch_size=500, flush_interval=0.5)
+    for _ in range(ROWS):
+        writer.put(type_stats=tables.StatsType.ME, lang="en")
+    enqueued = time.perf_counter()
+    writer.stop()
+    return enqueued
+
+
+def run(title: str, target):
+    global commits
+    commits = 0
+    before = count_stats()
+    start = time.perf_counter()
+    enqueued = target()
+    elapsed = time.perf_counter() - start
+    print(
+        f"{title:<15} enqueue: {(enqueued - start) / ROWS * 1e6:8.1f} us/row  "
+        f"written: {count_stats() - before} rows in {elapsed:.2f} s, {commits} commits"
+    )
+
+
+if __name__ == "__main__":
+    migrations.migrate()
+    run("thread per row", thread_per_row)
+    run("batched writer", batched_writer)
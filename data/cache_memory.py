@@ -1,4 +1,14 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import inspect
 import logging
+import operator
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
 from functools import wraps
 from typing import Any, Optional, Tuple, Dict, Hashable, Iterable, Callable, Union
 
@@ -10,94 +20,316 @@ https://github.com/david-lev (c) 2023
 True, Python has `lru_cache`, but I didn't really find it effective, and in many cases - I don't really care about
 objects being flooded in memory. Apart from that, `lru_cache` lacks such basic features:
 1. The ability to decide which parameters will be included in the cache key
-2. Do not cache on a result of None
+2. Do not cache on a result of None (or cache it as a negative result, with its own ttl)
 3: the flexibility in choosing the name of the cache
 4: the ability to delete a specific item from the cache
 5: run the function anyway and still store the cache
+6: a size limit (LRU eviction) and a time to live, per cache name
+7: single-flight, concurrent misses on the same key share one call, for regular and async functions
+8: tags, to delete the related data of many cache names with a single call
 (In the future, maybe I'll add more features for `lru_cache` and more)
 You will find all these, and more, in the realization before you:
 """
 
 
+# bump when the layout of the snapshot file changes, see `MemoryCache.dump`
+SNAPSHOT_FORMAT = 1
+
+_MISSING = object()  # not cached
+_NONE = object()  # a cached None result, see ``cache_none``
+
+
+class _Namespace:
+    """
+    The data and the settings of a single cache name
+        - The data is kept in least recently used order, so the first item is the next one to be evicted
+    """
+
+    __slots__ = (
+        "name",
+        "lock",
+        "data",
+        "maxsize",
+        "ttl",
+        "evictions",
+        "expirations",
+        "hits",
+        "misses",
+        "sets",
+        "invalidations",
+        "calls",
+        "call_time",
+        "coalesced",
+    )
+
+    def __init__(
+        self,
+        name: Hashable,
+        lock: Union[threading.RLock, contextlib.nullcontext],
+        maxsize: Optional[int] = None,
+        ttl: Optional[float] = None,
+    ):
+        self.name = name
+        self.lock = lock
+        self.data: OrderedDict = OrderedDict()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evictions = 0
+        self.expirations = 0
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.invalidations = 0
+        self.calls = 0
+        self.call_time = 0.0
+        self.coalesced = 0
+
+
 class MemoryCache:
     """
     Memory cache
-        - This cache is not persistent, it will be lost when the application is restarted or the server is restarted
+        - This cache is not persistent, it will be lost when the application is restarted or the server is restarted,
+          unless chosen cache names are saved with :meth:`dump` on shutdown and loaded with :meth:`restore` on startup
+        - Every cache name can be bounded with ``maxsize`` (least recently used items are evicted first)
+          and ``ttl`` (items older than ``ttl`` seconds are treated as missing)
+        - With ``thread_safe=True`` the cache can be shared by threads and the event loop: every cache name
+          has its own lock (so the locks are striped by cache name) and the tags index has another one
     """
 
-    def __init__(self):
-        logger.debug("memory cache initialized")
-        self._cache = {}
+    def __init__(self, thread_safe: bool = False):
+        logger.debug(f"memory cache initialized, {thread_safe=}")
+        self._thread_safe = thread_safe
+        self._lock = threading.RLock() if thread_safe else contextlib.nullcontext()
+        self._tags_lock = threading.Lock() if thread_safe else contextlib.nullcontext()
+        self._cache: Dict[Hashable, _Namespace] = {}
+        self._in_flight: Dict[Hashable, concurrent.futures.Future] = {}
+        self._in_flight_lock = threading.Lock()
+        self._async_in_flight: Dict[Hashable, asyncio.Task] = {}
+        self._tags: Dict[str, set] = {}
+        self._snapshot: Dict[Hashable, list] = {}
 
     @staticmethod
     def build_cache_id(*args, **kwargs) -> Tuple[Tuple[Any, ...], ...]:
-        """Build cache id"""
+        """Build cache id, the cache id of a function that is cached with ``params=None``"""
         return args, tuple(kwargs.items())
 
     @staticmethod
-    def _get_cache_id(
-        params: Optional[Union[Iterable[str], str]], *args, **kwargs
-    ) -> Tuple[Tuple[Any, ...], ...]:
-        """Get cache id"""
-        _kwargs = (
-            {
-                k: kwargs[k]
-                for k in (params if not isinstance(params, str) else (params,))
-            }
-            if params is not None
-            else kwargs
-        )
-        return MemoryCache.build_cache_id(
-            *args if params is not None else (), **_kwargs
-        )
+    def _cache_id_builder(
+        params: Optional[Union[Iterable[str], str]],
+    ) -> Callable[[tuple, dict], Hashable]:
+        """
+        Get the function that builds the cache id of a call, built once when the function is decorated
+            - ``params=None``: all the parameters, see :meth:`build_cache_id`
+            - ``params='tg_id'``: the value itself, ``1234``
+            - ``params=('a', 'b')``: the tuple of the values, ``(1, 2)``
+        """
+        if params is None:
+            return lambda args, kwargs: (args, tuple(kwargs.items()))
+        if isinstance(params, str):
+            return lambda args, kwargs: kwargs[params]
+        params = tuple(params)
+        if len(params) == 1:
+            param = params[0]
+            return lambda args, kwargs: (kwargs[param],)
+        get_values = operator.itemgetter(*params)
+        return lambda args, kwargs: get_values(kwargs)
+
+    def configure(
+        self,
+        cache_name: Hashable,
+        maxsize: Optional[int] = None,
+        ttl: Optional[float] = None,
+    ):
+        """
+        Set the limits of a cache name
+        :param cache_name: The cache name to configure
+        :param maxsize: The maximum number of items to keep, if None, the cache name is not bounded
+        :param ttl: The number of seconds an item is valid for, if None, the items never expire
+        """
+        namespace = self._get_namespace(cache_name)
+        with namespace.lock:
+            namespace.maxsize = maxsize
+            namespace.ttl = ttl
+            self._evict(namespace)
 
     def cachable(
         self,
         cache_name: Optional[Hashable] = None,
         params: Optional[Union[Iterable[str], str]] = None,
         always_execute: bool = False,
+        maxsize: Optional[int] = None,
+        ttl: Optional[float] = None,
+        single_flight: bool = False,
+        cache_none: bool = False,
+        none_ttl: Optional[float] = None,
+        tags: Optional[Union[Iterable[str], str]] = None,
     ) -> Callable:
         """
         Cache decorator
         Usage:
             >>> cache = MemoryCache()
-            >>> @cache.cachable(cache_name='math-plus', params=('a', 'b'))
+            >>> @cache.cachable(cache_name='math-plus', params=('a', 'b'), maxsize=1000, ttl=60)
             >>> def plus(*, a, b):  # The function must have keyword arguments in order to use the params argument
             >>>     return a + b
             >>> plus(a=1, b=2)  # The result will be cached
             3
             >>> plus(a=1, b=2)  # The result will be retrieved from the cache
             3
+            >>> @cache.cachable(cache_name='chats', params='username', ttl=60, single_flight=True)
+            >>> async def get_chat(*, client, username):  # ``async def`` functions are cached too
+            >>>     return await client.get_chat(username)
         :param cache_name: The cache name to use, must be a hashable object. If None, the function name will be used
-        :param params: The parameters to use as cache id, if None, all parameters will be used (*args, **kwargs)
+        :param params: The parameters to use as cache id, if None, all parameters will be used (*args, **kwargs).
+            The cache id of a single parameter is its value, and of a tuple of parameters - the tuple of their values
         :param always_execute: If True, the function will be executed even if the cache is valid. The result will be cached
+        :param maxsize: The maximum number of results to keep, the least recently used are evicted first
+        :param ttl: The number of seconds a result is valid for, if None, the results never expire
+        :param single_flight: If True, concurrent misses on the same cache id share a single call to the function.
+            Works for both regular and ``async def`` functions
+        :param cache_none: If True, a None result is cached as a negative result, "known absent", and returned
+            without calling the function again. By default a None result is not cached
+        :param none_ttl: The number of seconds a negative result is valid for, if None, ``ttl`` is used
+        :param tags: Tags to attach to every result, formatted with the keyword arguments of the call,
+            for example ``'user:{tg_id}'``. All the results of a tag can be deleted at once with :meth:`invalidate_tag`
         """
 
         def decorator(func):
-            @wraps(func)
-            def wrapper(*args, **kwargs):
-                nonlocal cache_name, params
-                cache_id = self._get_cache_id(params, *args, **kwargs)
-                if cache_name is None:
-                    cache_name = func.__name__
-                if always_execute:
-                    cache_data = func(*args, **kwargs)
-                    self.set(
-                        cache_name=cache_name, cache_id=cache_id, cache_data=cache_data
-                    )
+            name = func.__name__ if cache_name is None else cache_name
+            self.configure(cache_name=name, maxsize=maxsize, ttl=ttl)
+
+            namespace = self._get_namespace(name)
+            build_cache_id = self._cache_id_builder(params)
+            tag_formats = (tags,) if isinstance(tags, str) else tuple(tags or ())
+
+            def store(cache_id, cache_data, kwargs):
+                """Cache the result, a None result is cached only as a negative result"""
+                if cache_data is None and not cache_none:
+                    return
+                self.set(
+                    cache_name=name,
+                    cache_id=cache_id,
+                    cache_data=_NONE if cache_data is None else cache_data,
+                    ttl=none_ttl if cache_data is None else None,
+                    tags=[tag.format(**kwargs) for tag in tag_formats],
+                )
+
+            if inspect.iscoroutinefunction(func):
+
+                async def load(cache_id, *args, **kwargs):
+                    """Await the function, record the time spent in it and cache the result"""
+                    start = time.perf_counter()
+                    try:
+                        cache_data = await func(*args, **kwargs)
+                    finally:
+                        with namespace.lock:
+                            namespace.calls += 1
+                            namespace.call_time += time.perf_counter() - start
+                    store(cache_id, cache_data, kwargs)
                     return cache_data
-                cache_data = self.get(cache_name=cache_name, cache_id=cache_id)
-                if cache_data is None:
+
+                @wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    cache_id = build_cache_id(args, kwargs)
+                    if not always_execute:
+                        cache_data = self._lookup(cache_name=name, cache_id=cache_id)
+                        if cache_data is not _MISSING:
+                            return None if cache_data is _NONE else cache_data
+                    if single_flight:
+                        return await self._async_single_flight(
+                            namespace, (name, cache_id), load, cache_id, *args, **kwargs
+                        )
+                    return await load(cache_id, *args, **kwargs)
+
+                return async_wrapper
+
+            def load(cache_id, *args, **kwargs):
+                """Run the function, record the time spent in it and cache the result"""
+                start = time.perf_counter()
+                try:
                     cache_data = func(*args, **kwargs)
-                    self.set(
-                        cache_name=cache_name, cache_id=cache_id, cache_data=cache_data
-                    )
+                finally:
+                    with namespace.lock:
+                        namespace.calls += 1
+                        namespace.call_time += time.perf_counter() - start
+                store(cache_id, cache_data, kwargs)
                 return cache_data
 
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                cache_id = build_cache_id(args, kwargs)
+                if not always_execute:
+                    cache_data = self._lookup(cache_name=name, cache_id=cache_id)
+                    if cache_data is not _MISSING:
+                        return None if cache_data is _NONE else cache_data
+                if single_flight:
+                    return self._single_flight(
+                        namespace, (name, cache_id), load, cache_id, *args, **kwargs
+                    )
+                return load(cache_id, *args, **kwargs)
+
             return wrapper
 
         return decorator
 
+    def _single_flight(
+        self, namespace: _Namespace, key: Hashable, load: Callable, *args, **kwargs
+    ) -> Any:
+        """
+        Run ``load`` once for all the threads that miss the same key at the same time
+        :param namespace: The namespace to count the coalesced calls in
+        :param key: The in-flight key, the cache name and the cache id
+        :param load: The function that computes and caches the data
+        :return: The result of the single ``load`` call
+        """
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = concurrent.futures.Future()
+        if not leader:
+            with namespace.lock:
+                namespace.coalesced += 1
+            return future.result()
+        try:
+            result = load(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._in_flight_lock:
+                self._in_flight.pop(key, None)
+
+    async def _async_single_flight(
+        self, namespace: _Namespace, key: Hashable, load: Callable, *args, **kwargs
+    ) -> Any:
+        """
+        Await ``load`` once for all the tasks that miss the same key at the same time
+        :param namespace: The namespace to count the coalesced calls in
+        :param key: The in-flight key, the cache name and the cache id
+        :param load: The coroutine function that computes and caches the data
+        :return: The result of the single ``load`` call
+        """
+        task = self._async_in_flight.get(key)
+        if task is not None:
+            namespace.coalesced += 1
+        else:
+            # the load runs in its own task that every caller awaits through a shield,
+            # so a cancelled caller, the first one too, does not cancel the others
+            task = self._async_in_flight[key] = asyncio.ensure_future(
+                load(*args, **kwargs)
+            )
+
+            def done(_):
+                self._async_in_flight.pop(key, None)
+                if not task.cancelled():
+                    task.exception()  # retrieved, even if all the callers were cancelled
+
+            task.add_done_callback(done)
+        return await asyncio.shield(task)
+
     def invalidate(
         self,
         cache_name: Optional[Hashable] = None,
@@ -112,46 +344,198 @@ class MemoryCache:
             >>> def plus(*, a, b):  # The function must have keyword arguments in order to use the params argument
             >>>     return a + b
             >>> plus(a=1, b=2)  # The result will deleted from the cache
+        Works for both regular and ``async def`` functions
         :param cache_name: The cache name to use, must be a hashable object. If None, the function name will be used
-        :param params: The parameters to use as cache id, if None, all parameters will be used (*args, **kwargs)
+        :param params: The parameters to use as cache id, the same as in :meth:`cachable`
         :param before: If True, the cache will be invalidated before the function is executed. Default is after
         """
 
         def decorator(func):
+            name = func.__name__ if cache_name is None else cache_name
+            build_cache_id = self._cache_id_builder(params)
+
+            if inspect.iscoroutinefunction(func):
+
+                @wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    cache_id = build_cache_id(args, kwargs)
+                    if before:
+                        self.delete(cache_name=name, cache_id=cache_id)
+                    result = await func(*args, **kwargs)
+                    if not before:
+                        self.delete(cache_name=name, cache_id=cache_id)
+                    return result
+
+                return async_wrapper
+
             @wraps(func)
             def wrapper(*args, **kwargs):
-                nonlocal cache_name, params
-                cache_id = self._get_cache_id(params, *args, **kwargs)
-                if cache_name is None:
-                    cache_name = func.__name__
+                cache_id = build_cache_id(args, kwargs)
                 if before:
-                    self.delete(cache_name=cache_name, cache_id=cache_id)
+                    self.delete(cache_name=name, cache_id=cache_id)
                 result = func(*args, **kwargs)
                 if not before:
-                    self.delete(cache_name=cache_name, cache_id=cache_id)
+                    self.delete(cache_name=name, cache_id=cache_id)
                 return result
 
             return wrapper
 
         return decorator
 
+    def _find_namespace(self, cache_name: Hashable) -> Optional[_Namespace]:
+        """Get the namespace of the cache name, restore it first if it is waiting in a snapshot"""
+        if self._snapshot and cache_name in self._snapshot:
+            with self._lock:
+                if cache_name in self._snapshot:
+                    self._restore_namespace(cache_name)
+        return self._cache.get(cache_name)
+
+    def _get_namespace(self, cache_name: Hashable) -> _Namespace:
+        """Get the namespace of the cache name, create it if it does not exist"""
+        namespace = self._find_namespace(cache_name)
+        if namespace is None:
+            with self._lock:
+                namespace = self._cache.get(cache_name)
+                if namespace is None:
+                    namespace = self._cache[cache_name] = _Namespace(
+                        name=cache_name,
+                        lock=(
+                            threading.RLock()
+                            if self._thread_safe
+                            else contextlib.nullcontext()
+                        ),
+                    )
+        return namespace
+
+    def _tag(self, namespace: _Namespace, cache_id: Hashable, tags: Tuple[str, ...]):
+        """Add the item to the index of its tags"""
+        if not tags:
+            return
+        with self._tags_lock:
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add((namespace.name, cache_id))
+
+    def _untag(self, namespace: _Namespace, cache_id: Hashable, tags: Tuple[str, ...]):
+        """Remove a dropped item from the index of its tags"""
+        if not tags:
+            return
+        with self._tags_lock:
+            for tag in tags:
+                items = self._tags.get(tag)
+                if items is not None:
+                    items.discard((namespace.name, cache_id))
+                    if not items:
+                        del self._tags[tag]
+
+    def _evict(self, namespace: _Namespace):
+        """
+        Drop expired items from the head of the namespace and the oldest items above ``maxsize``
+            - Must be called with the lock of the namespace held
+        """
+        data = namespace.data
+        now = time.monotonic()
+        while data:
+            _, expires_at, _ = next(iter(data.values()))
+            if expires_at is None or expires_at > now:
+                break
+            cache_id, (_, _, tags) = data.popitem(last=False)
+            self._untag(namespace, cache_id, tags)
+            namespace.expirations += 1
+        if namespace.maxsize is not None:
+            while len(data) > namespace.maxsize:
+                cache_id, (_, _, tags) = data.popitem(last=False)
+                self._untag(namespace, cache_id, tags)
+                namespace.evictions += 1
+
+    def _lookup(
+        self, cache_name: Hashable, cache_id: Hashable, count_miss: bool = True
+    ) -> Any:
+        """
+        Get cached data without hiding the negative results
+        :param count_miss: If False, a miss is not counted, the caller counts it when it loads the data
+        :return: The cached data, ``_NONE`` for a cached None, or ``_MISSING`` if it is not cached or expired
+        """
+        namespace = self._find_namespace(cache_name)
+        if namespace is None:
+            return _MISSING
+        with namespace.lock:
+            entry = namespace.data.get(cache_id)
+            if entry is None:
+                namespace.misses += count_miss
+                return _MISSING
+            cache_data, expires_at, tags = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del namespace.data[cache_id]
+                self._untag(namespace, cache_id, tags)
+                namespace.expirations += 1
+                namespace.misses += count_miss
+                return _MISSING
+            namespace.data.move_to_end(cache_id)
+            namespace.hits += 1
+            return cache_data
+
     def get(self, cache_name: Hashable, cache_id: Hashable) -> Optional[Any]:
         """
         Get cached data
         :param cache_name: The cache name to get the data from
         :param cache_id: The cache id to get the data from
-        :return: The cached data
+        :return: The cached data, None if it is not cached, expired or cached as a negative result
         """
-        return self._cache.get(cache_name, {}).get(cache_id)
+        cache_data = self._lookup(cache_name=cache_name, cache_id=cache_id)
+        return None if cache_data is _MISSING or cache_data is _NONE else cache_data
 
-    def set(self, cache_name: Hashable, cache_id: Hashable, cache_data: Any):
+    def peek(
+        self,
+        cache_name: Hashable,
+        cache_id: Hashable,
+        default: Any = None,
+        count_miss: bool = True,
+    ) -> Any:
+        """
+        Get cached data, telling apart a negative result from data that is not cached
+        :param cache_name: The cache name to get the data from
+        :param cache_id: The cache id to get the data from
+        :param default: The value to return if the data is not cached or expired
+        :param count_miss: If False, a miss is not counted, for a caller that loads the data
+            with the :meth:`cachable` function on a miss, which counts it
+        :return: The cached data, None if it is cached as a negative result
+        """
+        cache_data = self._lookup(
+            cache_name=cache_name, cache_id=cache_id, count_miss=count_miss
+        )
+        if cache_data is _MISSING:
+            return default
+        return None if cache_data is _NONE else cache_data
+
+    def set(
+        self,
+        cache_name: Hashable,
+        cache_id: Hashable,
+        cache_data: Any,
+        ttl: Optional[float] = None,
+        tags: Iterable[str] = (),
+    ):
         """
         Set cached data
         :param cache_name: The cache name to set the data to
         :param cache_id: The cache id to set the data to
         :param cache_data: The data to cache
+        :param ttl: The number of seconds the data is valid for, if None, the ttl of the cache name is used
+        :param tags: The tags of the data, see :meth:`invalidate_tag`
         """
-        self._cache.setdefault(cache_name, {})[cache_id] = cache_data
+        namespace = self._get_namespace(cache_name)
+        tags = tuple(tags)
+        with namespace.lock:
+            ttl = namespace.ttl if ttl is None else ttl
+            expires_at = time.monotonic() + ttl if ttl is not None else None
+            old_entry = namespace.data.get(cache_id)
+            if old_entry is not None:
+                self._untag(namespace, cache_id, old_entry[2])
+            namespace.data[cache_id] = (cache_data, expires_at, tags)
+            namespace.data.move_to_end(cache_id)
+            self._tag(namespace, cache_id, tags)
+            namespace.sets += 1
+            self._evict(namespace)
 
     def delete(self, cache_name: Hashable, cache_id: Optional[Hashable] = None):
         """
@@ -159,21 +543,201 @@ class MemoryCache:
         :param cache_name: The cache name to delete the data from
         :param cache_id: The cache id to delete the data from, if None, all data from the cache name will be deleted
         """
-        if cache_id:
-            self._cache.get(cache_name, {}).pop(cache_id, None)
-        else:
-            self._cache.pop(cache_name, None)
+        namespace = self._find_namespace(cache_name)
+        if namespace is None:
+            return
+        with namespace.lock:
+            namespace.invalidations += 1
+            if cache_id is not None:
+                entry = namespace.data.pop(cache_id, None)
+                if entry is not None:
+                    self._untag(namespace, cache_id, entry[2])
+            else:
+                self._delete_all(namespace)
+
+    def _delete_all(self, namespace: _Namespace):
+        """Delete all the data of the namespace, must be called with the lock of the namespace held"""
+        for cache_id, (_, _, tags) in namespace.data.items():
+            self._untag(namespace, cache_id, tags)
+        namespace.data.clear()
+
+    def invalidate_tag(self, tag: str) -> int:
+        """
+        Delete all the cached data tagged with ``tag``, across all the cache names
+        Usage:
+            >>> cache = MemoryCache()
+            >>> @cache.cachable(cache_name='user-name', params='tg_id', tags='user:{tg_id}')
+            >>> def get_name(*, tg_id):
+            >>>     ...
+            >>> cache.invalidate_tag('user:1234')  # get_name(tg_id=1234) will be deleted from the cache
+        :param tag: The tag to delete the data of
+        :return: The number of deleted items
+        """
+        with self._tags_lock:
+            items = self._tags.pop(tag, ())
+        deleted = 0
+        for cache_name, cache_id in items:
+            namespace = self._cache[cache_name]
+            with namespace.lock:
+                entry = namespace.data.get(cache_id)
+                if entry is None or tag not in entry[2]:
+                    continue  # dropped, or replaced without the tag, in the meantime
+                del namespace.data[cache_id]
+                namespace.invalidations += 1
+                deleted += 1
+                # the item may have more tags than the one being invalidated
+                self._untag(namespace, cache_id, tuple(t for t in entry[2] if t != tag))
+        return deleted
 
     def clear(self):
-        """Clear all cached data"""
-        self._cache = {}
+        """Clear all cached data, the limits of the cache names are kept"""
+        with self._lock:
+            self._snapshot = {}
+            namespaces = list(self._cache.values())
+        for namespace in namespaces:
+            with namespace.lock:
+                self._delete_all(namespace)
+
+    def dump(
+        self, path: str, cache_names: Iterable[Hashable], version: Hashable
+    ) -> int:
+        """
+        Save the data of the cache names to a binary snapshot file, to be loaded by :meth:`restore`
+            - Negative results and expired data are not saved
+        Usage:
+            >>> cache = MemoryCache()
+            >>> cache.dump('cache.bin', cache_names=('get_user',), version=1)  # on shutdown
+            >>> cache.restore('cache.bin', version=1)  # on startup
+        :param path: The file to write the snapshot to, it is replaced atomically
+        :param cache_names: The cache names to save
+        :param version: The version of the cached data, a snapshot of another version is discarded by :meth:`restore`
+        :return: The number of saved items
+        """
+        now, wall_now = time.monotonic(), time.time()
+        namespaces = {}
+        for cache_name in cache_names:
+            namespace = self._find_namespace(cache_name)
+            if namespace is None:
+                continue
+            with namespace.lock:
+                entries = list(namespace.data.items())
+            items = namespaces[cache_name] = []
+            for cache_id, (cache_data, expires_at, tags) in entries:
+                if cache_data is _NONE:
+                    continue
+                if expires_at is not None:
+                    if expires_at <= now:
+                        continue
+                    # the monotonic clock starts again on restart, save the wall clock time
+                    expires_at = expires_at - now + wall_now
+                items.append((cache_id, cache_data, expires_at, tags))
 
-    def get_stats(self) -> Dict[Hashable, int]:
-        """Return cache stats, the number of cached data per cache name"""
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            pickle.dump(
+                {
+                    "format": SNAPSHOT_FORMAT,
+                    "version": version,
+                    "namespaces": namespaces,
+                },
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(temp_path, path)
+        count = sum(len(items) for items in namespaces.values())
+        logger.info(f"cache snapshot saved: {count} items to {path}")
+        return count
+
+    def restore(self, path: str, version: Hashable) -> bool:
+        """
+        Load a snapshot file saved by :meth:`dump`
+            - The file is deleted after it is read, so a snapshot is never loaded twice (for example after a crash)
+            - A snapshot of another format or version is discarded
+            - The items are added lazily, each cache name is filled on its first use
+        :param path: The file to read the snapshot from
+        :param version: The expected version of the cached data
+        :return: True if the snapshot was loaded
+        """
+        try:
+            with open(path, "rb") as f:
+                snapshot = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning(f"cache snapshot {path} can not be read, discarded: {e}")
+            snapshot = None
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+        if (
+            not isinstance(snapshot, dict)
+            or snapshot.get("format") != SNAPSHOT_FORMAT
+            or snapshot.get("version") != version
+        ):
+            if snapshot is not None:
+                logger.warning(f"cache snapshot {path} is stale, discarded")
+            return False
+
+        self._snapshot = snapshot["namespaces"]
+        logger.info(f"cache snapshot loaded from {path}: {list(self._snapshot)}")
+        return True
+
+    def _restore_namespace(self, cache_name: Hashable):
+        """Add the items of the cache name from the loaded snapshot, the items that are already cached win"""
+        items = self._snapshot.pop(cache_name)
+        namespace = self._get_namespace(cache_name)
+        now, wall_now = time.monotonic(), time.time()
+        with namespace.lock:
+            for cache_id, cache_data, expires_at, tags in reversed(items):
+                if cache_id in namespace.data:
+                    continue
+                if expires_at is not None:
+                    if expires_at <= wall_now:
+                        continue
+                    expires_at = expires_at - wall_now + now
+                namespace.data[cache_id] = (cache_data, expires_at, tags)
+                # the snapshot is older than the data of this run
+                namespace.data.move_to_end(cache_id, last=False)
+                self._tag(namespace, cache_id, tags)
+            self._evict(namespace)
+
+    def get_stats(self) -> Dict[Hashable, Dict[str, Union[int, float]]]:
+        """
+        Return cache stats per cache name, every counter is kept up to date on the fly
+            - size: the number of cached data
+            - evictions, expirations: the number of data dropped by ``maxsize`` and by ``ttl``
+            - hits, misses, sets, invalidations: the number of operations on the cache name
+            - calls, call_time: the number of calls to the cached function and the seconds spent in it
+            - coalesced: the number of calls that waited for an in-flight call instead of calling the function
+        """
         return {
-            cache_name: len([i for i in cache if cache[i] is not None])
-            for cache_name, cache in self._cache.items()
+            cache_name: {
+                "size": len(namespace.data),
+                "evictions": namespace.evictions,
+                "expirations": namespace.expirations,
+                "hits": namespace.hits,
+                "misses": namespace.misses,
+                "sets": namespace.sets,
+                "invalidations": namespace.invalidations,
+                "calls": namespace.calls,
+                "call_time": namespace.call_time,
+                "coalesced": namespace.coalesced,
+            }
+            for cache_name, namespace in list(self._cache.items())
         }
 
+    def reset_stats(self):
+        """Reset the counters of all the cache names, the cached data is kept"""
+        for namespace in list(self._cache.values()):
+            with namespace.lock:
+                namespace.evictions = namespace.expirations = 0
+                namespace.hits = namespace.misses = 0
+                namespace.sets = namespace.invalidations = 0
+                namespace.calls = 0
+                namespace.call_time = 0.0
+                namespace.coalesced = 0
+
 
-cache_memory = MemoryCache()
+# shared by the event loop and the background threads of the bot
+cache_memory = MemoryCache(thread_safe=True)
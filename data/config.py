@@ -1,4 +1,5 @@
 from functools import lru_cache
+from typing import Literal
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -14,6 +15,41 @@ class Settings(BaseSettings):
     admins: list[int]
     limit_spam: int
     admin_to_update_of_payment: int
+    cache_snapshot_path: str = "cache_snapshot.bin"
+    # database, the pragmas are applied to every new connection
+    sqlite_path: str = "bot_db.sqlite"
+    sqlite_journal_mode: Literal["WAL", "DELETE", "TRUNCATE", "PERSIST"] = "WAL"
+    sqlite_synchronous: Literal["OFF", "NORMAL", "FULL", "EXTRA"] = "NORMAL"
+    sqlite_mmap_size: int = 256 * 2**20  # bytes
+    sqlite_cache_size: int = -64_000  # negative is KiB, positive is pages
+    sqlite_busy_timeout: int = 5_000  # milliseconds
+    sqlite_temp_store: Literal["DEFAULT", "FILE", "MEMORY"] = "MEMORY"
+    db_pool_size: int = 5
+    db_max_overflow: int = 5
+    # the background writer of the usage stats
+    stats_queue_size: int = 10_000
+    stats_batch_size: int = 500
+    stats_flush_interval: float = 1.0  # seconds
+    # retention of the old rows, 0 days keeps them forever
+    retention_stats_days: int = 90
+    retention_message_sent_days: int = 30
+    retention_interval: float = 6 * 60 * 60  # seconds
+    retention_chunk_size: int = 1_000
+    retention_chunk_pause: float = 0.05  # seconds between the chunks
+    retention_vacuum_pages: int = 1_000
+    # a database created without auto_vacuum needs one full VACUUM to give the deleted rows back
+    # to the file system. it locks the database and needs free disk space of about the file
+    # size, so it runs at startup only when enabled, once, in a maintenance window
+    retention_enable_incremental_vacuum: bool = False
+    # the broadcast, telegram allows a bot about 30 messages per second
+    broadcast_rate: float = 25.0  # messages per second, lowered on FloodWait
+    broadcast_min_rate: float = 1.0
+    broadcast_workers: int = 16
+    # the sent messages of a broadcast are recorded in bulk, every N rows or T seconds
+    broadcast_record_batch: int = 200
+    broadcast_record_interval: float = 0.5  # seconds
+    # the status message of a broadcast or a /delete is edited at most once per interval
+    progress_interval: float = 5.0  # seconds
 
 
 @lru_cache
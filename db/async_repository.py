@@ -0,0 +1,140 @@
+# this file contains the async versions of the database operations, for the handlers.
+# the queries run on a dedicated DB executor, so a slow disk does not stall the event loop
+
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable
+
+from db import repository
+from db.repository import UserRecord
+
+
+_logger = logging.getLogger(__name__)
+
+cache = repository.cache
+
+# one thread, so the queries run in the order they were awaited. the user record cache is
+# written through by the writers, with a second thread a get_user that read the row before an
+# update could store its stale record after the update was cached
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+_NOT_CACHED = object()
+
+
+def _in_db_executor(func: Callable) -> Callable[..., Awaitable]:
+    """Run the database operation on the DB executor and await its result"""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(
+            _executor, functools.partial(func, *args, **kwargs)
+        )
+
+    return wrapper
+
+
+def shutdown():
+    """Wait for the queued database operations and stop the DB executor"""
+    _executor.shutdown(wait=True)
+
+
+# user
+
+_get_user_from_db = _in_db_executor(repository.get_user)
+
+
+async def get_user(*, tg_id: int) -> UserRecord | None:
+    """
+    Get user by tg id, a cached record is returned without leaving the event loop
+    :param tg_id: the user id
+    :return: :class:`UserRecord`, None if the user does not exist
+    """
+    # the miss is counted once, by the cached function that loads the user
+    user = cache.peek(
+        "get_user", cache_id=tg_id, default=_NOT_CACHED, count_miss=False
+    )
+    if user is not _NOT_CACHED:
+        return user
+    return await _get_user_from_db(tg_id=tg_id)
+
+
+def get_cached_user(*, tg_id: int) -> UserRecord | None:
+    """
+    Get the cached user record, without a database query
+    :param tg_id: the user id
+    :return: :class:`UserRecord`, None if the user is not cached or does not exist
+    """
+    return cache.peek("get_user", cache_id=tg_id)
+
+
+async def is_user_exists(*, tg_id: int) -> bool:
+    """Check if user exists in DB or not"""
+
+    return await get_user(tg_id=tg_id) is not None
+
+
+async def is_active(*, tg_id: int) -> bool | None:
+    """Check if user active or not."""
+
+    user = await get_user(tg_id=tg_id)
+    return user.active if user is not None else None
+
+
+async def is_admin(*, tg_id: int) -> bool | None:
+    """Check if user admin or not"""
+
+    user = await get_user(tg_id=tg_id)
+    return user.admin if user is not None else None
+
+
+async def get_user_language(*, tg_id: int) -> str | None:
+    """
+    Get user language by tg id
+    :param tg_id: the user id
+    :return: str
+    """
+
+    user = await get_user(tg_id=tg_id)
+    return user.lang if user is not None else None
+
+
+create_user = _in_db_executor(repository.create_user)
+update_user = _in_db_executor(repository.update_user)
+upsert_user = _in_db_executor(repository.upsert_user)
+
+# group
+
+is_group_exists = _in_db_executor(repository.is_group_exists)
+create_group = _in_db_executor(repository.create_group)
+update_group = _in_db_executor(repository.update_group)
+get_group = _in_db_executor(repository.get_group)
+
+# stats
+
+get_bot_stats = _in_db_executor(repository.get_bot_stats)
+get_users_count_active = _in_db_executor(repository.get_users_count_active)
+get_groups_count_active = _in_db_executor(repository.get_groups_count_active)
+get_active_users_page = _in_db_executor(repository.get_active_users_page)
+get_active_groups_page = _in_db_executor(repository.get_active_groups_page)
+get_usage_by_type = _in_db_executor(repository.get_usage_by_type)
+get_usage_by_lang = _in_db_executor(repository.get_usage_by_lang)
+
+# broadcast_job
+
+create_broadcast_job = _in_db_executor(repository.create_broadcast_job)
+update_broadcast_job = _in_db_executor(repository.update_broadcast_job)
+get_broadcast_job = _in_db_executor(repository.get_broadcast_job)
+get_running_broadcast_jobs = _in_db_executor(repository.get_running_broadcast_jobs)
+
+# message_sent
+
+create_messages_sent_many = _in_db_executor(repository.create_messages_sent_many)
+is_message_sent_exists = _in_db_executor(repository.is_message_sent_exists)
+get_messages_to_delete_page = _in_db_executor(repository.get_messages_to_delete_page)
+get_messages_to_delete_count = _in_db_executor(
+    repository.get_messages_to_delete_count
+)
+set_messages_sent_deleted = _in_db_executor(repository.set_messages_sent_deleted)
+get_sent_chat_ids = _in_db_executor(repository.get_sent_chat_ids)
@@ -0,0 +1,134 @@
+# this file contains the schema migrations of the database.
+# the schema version is kept in PRAGMA user_version, every migration runs in its own transaction
+
+import logging
+import time
+from typing import Callable
+
+from sqlalchemy import Connection, exists, func, insert, select, text
+
+from db.tables import (
+    engine,
+    User,
+    Group,
+    MessageSent,
+    Stats,
+    StatsDaily,
+    BroadcastJob,
+)
+
+
+_logger = logging.getLogger(__name__)
+
+MIGRATIONS: list[Callable[[Connection], None]] = []
+
+
+def migration(apply: Callable[[Connection], None]) -> Callable[[Connection], None]:
+    """Register a migration, the version of the schema is its position in the list"""
+    MIGRATIONS.append(apply)
+    return apply
+
+
+def has_column(connection: Connection, table: str, column: str) -> bool:
+    """
+    Check if the table has the column (the tables of a new database are created with all the columns)
+    :param connection: the connection of the migration
+    :param table: the table name
+    :param column: the column name
+    :return: bool
+    """
+    rows = connection.exec_driver_sql(f'PRAGMA table_info("{table}")')
+    return any(row[1] == column for row in rows)
+
+
+def create_missing_indexes(connection: Connection, tables: list):
+    """
+    Create the indexes of the tables that the database does not have yet
+    :param connection: the connection of the migration
+    :param tables: the table classes
+    """
+    for table in tables:
+        for index in table.__table__.indexes:
+            if not engine.dialect.has_index(connection, table.__tablename__, index.name):
+                _logger.info(f"Creating the index {index.name}")
+                index.create(connection)
+
+
+# the migrations, in order. a database that was created before the migrations has version 0
+# and may already have some of the changes, so the migrations check before they create
+
+
+@migration
+def create_tables(connection: Connection):
+    for table in (User, Group, MessageSent, Stats):
+        table.__table__.create(connection, checkfirst=True)
+
+
+@migration
+def create_stats_daily(connection: Connection):
+    StatsDaily.__table__.create(connection, checkfirst=True)
+    if connection.scalar(select(exists().where(StatsDaily.id.isnot(None)))):
+        return
+
+    day = func.date(Stats.created_at)
+    lang = func.coalesce(Stats.lang, "")
+    result = connection.execute(
+        insert(StatsDaily).from_select(
+            ["day", "type", "lang", "count"],
+            select(day, Stats.type, lang, func.count()).group_by(day, Stats.type, lang),
+        )
+    )
+    _logger.info(f"The daily stats were filled from the stats, {result.rowcount} rows")
+
+
+@migration
+def create_lookup_indexes(connection: Connection):
+    create_missing_indexes(connection, [User, Group, MessageSent])
+
+
+@migration
+def create_user_stats_indexes(connection: Connection):
+    create_missing_indexes(connection, [User])
+
+
+@migration
+def create_broadcast_job(connection: Connection):
+    BroadcastJob.__table__.create(connection, checkfirst=True)
+
+
+@migration
+def add_message_sent_deleted(connection: Connection):
+    if not has_column(connection, "message_sent", "deleted"):
+        connection.exec_driver_sql(
+            "ALTER TABLE message_sent ADD COLUMN deleted BOOLEAN NOT NULL DEFAULT 0"
+        )
+
+
+def migrate():
+    """
+    Apply the migrations that the database does not have yet, each one in a transaction
+    together with its new schema version, so a failed migration leaves the previous version
+    """
+
+    # the transactions are handled here, the driver would not open one for the DDL
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        version = connection.scalar(text("PRAGMA user_version"))
+        if version > len(MIGRATIONS):
+            raise RuntimeError(
+                f"The database schema version {version} is newer than the code ({len(MIGRATIONS)})"
+            )
+
+        for number, apply in enumerate(MIGRATIONS[version:], start=version + 1):
+            _logger.info(f"Migrating the database to version {number}: {apply.__name__}")
+            start = time.perf_counter()
+            connection.exec_driver_sql("BEGIN IMMEDIATE")
+            try:
+                apply(connection)
+                connection.exec_driver_sql(f"PRAGMA user_version={number}")
+            except Exception:
+                connection.exec_driver_sql("ROLLBACK")
+                raise
+            connection.exec_driver_sql("COMMIT")
+            _logger.info(
+                f"The database is at version {number} ({time.perf_counter() - start:.2f} s)"
+            )
@@ -2,9 +2,22 @@
 
 import datetime
 import logging
-from sqlalchemy import exists, func
-
-from db.tables import get_session, User, Group, MessageSent, StatsType, Stats
+from collections import Counter
+from typing import Iterator
+from sqlalchemy import Row, exists, func, insert, select, tuple_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from db.tables import (
+    get_session,
+    User,
+    Group,
+    MessageSent,
+    StatsType,
+    Stats,
+    StatsDaily,
+    BroadcastJob,
+    BroadcastStatus,
+)
 from data import cache_memory
 
 
@@ -12,32 +25,113 @@ _logger = logging.getLogger(__name__)
 
 cache = cache_memory.cache_memory
 
+# the user records cache holds one item per user, keep only the recently active ones
+USER_CACHE_MAXSIZE = 50_000
+USER_CACHE_TTL = 60 * 60
+# unknown users are cached as "known absent" for a shorter time
+USER_NEGATIVE_CACHE_TTL = 5 * 60
+# the caches saved on shutdown and loaded on startup, bump the version when `UserRecord`
+# or the cache ids change, so an old snapshot is discarded
+SNAPSHOT_CACHE_NAMES = ("get_user",)
+SNAPSHOT_VERSION = 2
+# the caches derived from a user (like the help keyboard in the user language) are tagged
+# with it, see `cache.invalidate_tag`
+USER_CACHE_TAG = "user:{tg_id}"
+# the /stats snapshot is computed at most once per ttl
+BOT_STATS_CACHE_TTL = 60
+BOT_STATS_LANGUAGES = 10
+BOT_STATS_SIGNUP_DAYS = 7
+
 
 # user
 
 
-@cache.cachable(cache_name="is_user_exists", params="tg_id")
+class UserRecord:
+    """The fields of a user that are needed on every update, cached by `get_user`"""
+
+    __slots__ = ("id", "tg_id", "lang", "active", "admin", "business_id")
+
+    def __init__(
+        self,
+        *,
+        id: int,
+        tg_id: int,
+        lang: str | None,
+        active: bool,
+        admin: bool,
+        business_id: str | None,
+    ):
+        self.id = id
+        self.tg_id = tg_id
+        self.lang = lang
+        self.active = active
+        self.admin = admin
+        self.business_id = business_id
+
+    def __repr__(self) -> str:
+        return (
+            f"UserRecord(tg_id={self.tg_id}, lang={self.lang}, "
+            f"active={self.active}, admin={self.admin})"
+        )
+
+
+@cache.cachable(
+    cache_name="get_user",
+    params="tg_id",
+    maxsize=USER_CACHE_MAXSIZE,
+    ttl=USER_CACHE_TTL,
+    single_flight=True,
+    cache_none=True,
+    none_ttl=USER_NEGATIVE_CACHE_TTL,
+)
+def get_user(*, tg_id: int) -> UserRecord | None:
+    """
+    Get user by tg id, the record is kept up to date by `create_user`, `upsert_user` and
+    `update_user`
+    :param tg_id: the user id
+    :return: :class:`UserRecord`, None if the user does not exist
+    """
+
+    with get_session() as session:
+        row = (
+            session.query(
+                User.id, User.tg_id, User.lang, User.active, User.admin, User.business_id
+            )
+            .filter(User.tg_id == tg_id)
+            .one_or_none()
+        )
+    return UserRecord(**row._asdict()) if row is not None else None
+
+
 def is_user_exists(*, tg_id: int) -> bool:
     """Check if user exists in DB or not"""
 
-    with get_session() as session:
-        return session.query(exists().where(User.tg_id == tg_id)).scalar()  # noqa
+    return get_user(tg_id=tg_id) is not None
 
 
-@cache.cachable(cache_name="is_active", params="tg_id")
-def is_active(*, tg_id: int) -> bool:
+def is_active(*, tg_id: int) -> bool | None:
     """Check if user active or not."""
 
-    with get_session() as session:
-        return session.query(User.active).filter(User.tg_id == tg_id).scalar()
+    user = get_user(tg_id=tg_id)
+    return user.active if user is not None else None
 
 
-@cache.cachable(cache_name="is_admin", params="tg_id")
-def is_admin(*, tg_id: int) -> bool:
+def is_admin(*, tg_id: int) -> bool | None:
     """Check if user admin or not"""
 
-    with get_session() as session:
-        return session.query(User.admin).filter(User.tg_id == tg_id).scalar()
+    user = get_user(tg_id=tg_id)
+    return user.admin if user is not None else None
+
+
+def get_user_language(*, tg_id: int) -> str | None:
+    """
+    Get user language by tg id
+    :param tg_id: the user id
+    :return: str
+    """
+
+    user = get_user(tg_id=tg_id)
+    return user.lang if user is not None else None
 
 
 def create_user(
@@ -61,13 +155,6 @@ def create_user(
 
     _logger.debug(f"Create user: {tg_id=}, {name=}, {username=}, {language_code=}")
 
-    # delete the cache
-    cache.delete("is_user_exists", cache_id=cache.build_cache_id(tg_id=tg_id))
-    cache.delete("is_active", cache_id=cache.build_cache_id(tg_id=tg_id))
-    cache.delete("is_admin", cache_id=cache.build_cache_id(tg_id=tg_id))
-    cache.delete("get_user", cache_id=cache.build_cache_id(tg_id=tg_id))
-    cache.delete("get_user_language", cache_id=cache.build_cache_id(tg_id=tg_id))
-
     with get_session() as session:
         user = User(
             tg_id=tg_id,
@@ -80,52 +167,102 @@ def create_user(
             created_at=datetime.datetime.now(),
         )
         session.add(user)
+        session.flush()
+        record = UserRecord(
+            id=user.id,
+            tg_id=tg_id,
+            lang=language_code,
+            active=active,
+            admin=admin,
+            business_id=None,
+        )
         session.commit()
 
+    # write the new user through to the cache, it replaces a "known absent" result.
+    # done after the commit, so a lookup before the commit can not cache the old row again
+    cache.set("get_user", cache_id=tg_id, cache_data=record)
+    cache.invalidate_tag(USER_CACHE_TAG.format(tg_id=tg_id))
 
-def update_user(*, tg_id: int, **kwargs):
+
+def upsert_user(
+    *,
+    tg_id: int,
+    name: str,
+    username: str = None,
+    language_code: str,
+    admin: bool | None = None,
+    update_profile: bool = True,
+) -> UserRecord:
     """
-    Update user
+    Create tg user, or update the existing one, in one statement
     :param tg_id: the user id
-    :param kwargs: the data to update
+    :param name: the name of user
+    :param username: the username of user
+    :param language_code: the language code of user
+    :param admin: is admin or not, None keeps it as it is (False for a new user)
+    :param update_profile: refresh the name, username and language code and reactivate
+        an existing user, default is True
+    :return: :class:`UserRecord`
     """
 
-    _logger.debug(f"Update user: {tg_id=}, {kwargs=}")
-
-    # delete the cache
-    cache.delete("is_user_exists", cache_id=cache.build_cache_id(tg_id=tg_id))
-    cache.delete("is_active", cache_id=cache.build_cache_id(tg_id=tg_id))
-    cache.delete("is_admin", cache_id=cache.build_cache_id(tg_id=tg_id))
-    cache.delete("get_user", cache_id=cache.build_cache_id(tg_id=tg_id))
-    cache.delete("get_user_language", cache_id=cache.build_cache_id(tg_id=tg_id))
+    _logger.debug(f"Upsert user: {tg_id=}, {name=}, {username=}, {language_code=}")
+
+    upsert = sqlite_insert(User).values(
+        tg_id=tg_id,
+        name=name,
+        username=username,
+        language_code=language_code,
+        lang=language_code,
+        admin=bool(admin),
+        active=True,
+        created_at=datetime.datetime.now(),
+    )
+    # tg_id=tg_id is a no-op, it makes sure the row is updated and returned
+    update = dict(tg_id=upsert.excluded.tg_id)
+    if update_profile:
+        update.update(
+            name=upsert.excluded.name,
+            username=upsert.excluded.username,
+            language_code=upsert.excluded.language_code,
+            active=True,
+        )
+    if admin is not None:
+        update.update(admin=admin)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[User.tg_id], set_=update
+    ).returning(
+        User.id, User.tg_id, User.lang, User.active, User.admin, User.business_id
+    )
 
     with get_session() as session:
-        session.query(User).filter(User.tg_id == tg_id).update(kwargs)
+        record = UserRecord(**session.execute(upsert).one()._asdict())
         session.commit()
 
+    cache.set("get_user", cache_id=tg_id, cache_data=record)
+    cache.invalidate_tag(USER_CACHE_TAG.format(tg_id=tg_id))
+    return record
 
-@cache.cachable(cache_name="get_user", params="tg_id")
-def get_user(*, tg_id: int) -> User:
-    """
-    Get user by tg id
-    :param tg_id: the user id
-    :return: :class:`Group`
-    """
 
-    with get_session() as session:
-        return session.query(User).filter(User.tg_id == tg_id).one()
-
-
-@cache.cachable(cache_name="get_user_language", params="tg_id")
-def get_user_language(*, tg_id: int) -> str:
+def update_user(*, tg_id: int, **kwargs):
     """
-    Get user language by tg id
+    Update user
     :param tg_id: the user id
-    :return: str
+    :param kwargs: the data to update
     """
 
+    _logger.debug(f"Update user: {tg_id=}, {kwargs=}")
+
     with get_session() as session:
-        return session.query(User.lang).filter(User.tg_id == tg_id).scalar()
+        session.query(User).filter(User.tg_id == tg_id).update(kwargs)
+        session.commit()
+
+    # write the changes through to the cached record instead of fetching it again
+    record = cache.get("get_user", cache_id=tg_id)
+    if record is not None:
+        for field, value in kwargs.items():
+            if field in UserRecord.__slots__:
+                setattr(record, field, value)
+    cache.invalidate_tag(USER_CACHE_TAG.format(tg_id=tg_id))
 
 
 # group
@@ -164,7 +301,7 @@ def create_group(
             name=name,
             username=username,
             created_at=datetime.datetime.now(),
-            added_by=user,
+            added_by_id=user.id,
             active=active,
         )
         session.add(group)
@@ -198,11 +335,61 @@ def get_group(*, group_id: int) -> Group:
 # stats
 
 
-def get_all_users_count() -> int:
-    """Get all users count"""
+@cache.cachable(cache_name="get_bot_stats", ttl=BOT_STATS_CACHE_TTL, single_flight=True)
+def get_bot_stats() -> dict:
+    """
+    Get the users and groups counts in one query, with the breakdowns per language
+    and per signup day
+    :return: dict with users, users_active, business, groups, groups_active,
+        languages (list of (lang, users, active)) and signups (list of (day, users))
+    """
+
+    # one statement, every count is served by an index (a conditional sum would read the table)
+    counts = select(
+        select(func.count(User.id)).scalar_subquery().label("users"),
+        select(func.count(User.id))
+        .where(User.active == True)  # noqa
+        .scalar_subquery()
+        .label("users_active"),
+        select(func.count(User.business_id))
+        .where(User.business_id != None)  # noqa
+        .scalar_subquery()
+        .label("business"),
+        select(func.count(Group.id)).scalar_subquery().label("groups"),
+        select(func.count(Group.id))
+        .where(Group.active == True)  # noqa
+        .scalar_subquery()
+        .label("groups_active"),
+    )
+
+    users_count = func.count()
+    day = func.date(User.created_at)
+    first_day = datetime.date.today() - datetime.timedelta(days=BOT_STATS_SIGNUP_DAYS - 1)
 
     with get_session() as session:
-        return session.query(func.count(User.id)).scalar()
+        counts = session.execute(counts).one()._asdict()
+        languages = session.execute(
+            select(
+                User.lang,
+                users_count,
+                func.count().filter(User.active == True),  # noqa
+            )
+            .group_by(User.lang)
+            .order_by(users_count.desc())
+            .limit(BOT_STATS_LANGUAGES)
+        ).all()
+        signups = session.execute(
+            select(day, users_count)
+            .where(User.created_at >= first_day)
+            .group_by(day)
+            .order_by(day)
+        ).all()
+
+    return dict(
+        **counts,
+        languages=[tuple(row) for row in languages],
+        signups=[tuple(row) for row in signups],
+    )
 
 
 def get_users_count_active() -> int:
@@ -228,11 +415,38 @@ def get_all_users_active() -> list[User]:
         return session.query(User).filter(User.active == True).all()  # noqa
 
 
-def get_all_groups_count() -> int:
-    """Get all groups count"""
+def get_active_users_page(*, after_id: int, limit: int) -> list[Row]:
+    """
+    Get a page of the active users, only the columns that a broadcast needs, ordered by id
+    :param after_id: the id of the last user of the previous page, 0 for the first page
+    :param limit: the maximum number of users in the page
+    :return: list of rows with id, tg_id, name, username and language_code
+    """
 
     with get_session() as session:
-        return session.query(func.count(Group.id)).scalar()
+        return (
+            session.query(
+                User.id, User.tg_id, User.name, User.username, User.language_code
+            )
+            .filter(User.active == True, User.id > after_id)  # noqa
+            .order_by(User.id)
+            .limit(limit)
+            .all()
+        )
+
+
+def iter_active_users(*, batch_size: int = 1_000) -> Iterator[Row]:
+    """
+    Iterate the active users page by page (keyset pagination on the id), so the memory does
+    not grow with the number of users and no read transaction stays open between the pages
+    :param batch_size: the number of users in a page
+    :return: iterator of rows with id, tg_id, name, username and language_code
+    """
+
+    after_id = 0
+    while page := get_active_users_page(after_id=after_id, limit=batch_size):
+        yield from page
+        after_id = page[-1].id
 
 
 def get_groups_count_active() -> int:
@@ -249,29 +463,130 @@ def get_all_groups_active() -> list[Group]:
         return session.query(Group).filter(Group.active == True).all()  # noqa
 
 
-# message_sent
+def get_active_groups_page(*, after_id: int, limit: int) -> list[Row]:
+    """
+    Get a page of the active groups, only the columns that a broadcast needs, ordered by id
+    :param after_id: the id of the last group of the previous page, 0 for the first page
+    :param limit: the maximum number of groups in the page
+    :return: list of rows with id, group_id, name and username
+    """
+
+    with get_session() as session:
+        return (
+            session.query(Group.id, Group.group_id, Group.name, Group.username)
+            .filter(Group.active == True, Group.id > after_id)  # noqa
+            .order_by(Group.id)
+            .limit(limit)
+            .all()
+        )
 
 
-def create_message_sent(*, sent_id: str, chat_id: int, message_id: int) -> MessageSent:
-    """Create message sent
+# broadcast_job
+
+
+def create_broadcast_job(
+    *,
+    sent_id: str,
+    target: str,
+    from_chat_id: int,
+    message_id: int,
+    forward: bool,
+    admin_id: int,
+    total: int,
+) -> BroadcastJob:
+    """
+    Create a running broadcast job
     :param sent_id: the sent id
-    :param chat_id: the chat id
-    :param message_id: the message id
-    :return: :class:`MessageSent`
+    :param target: users or groups
+    :param from_chat_id: the chat of the message to send
+    :param message_id: the message to send
+    :param forward: forward the message with credit, or copy it
+    :param admin_id: the admin that gets the report
+    :param total: the number of recipients
+    :return: :class:`BroadcastJob`
     """
 
-    _logger.debug(f"Create message sent: {sent_id=}, {chat_id=}, {message_id=}")
+    _logger.debug(f"Create broadcast job: {sent_id=}, {target=}, {total=}")
 
+    now = datetime.datetime.now()
     with get_session() as session:
-        message_sent = MessageSent(
+        job = BroadcastJob(
             sent_id=sent_id,
-            chat_id=chat_id,
+            target=target,
+            from_chat_id=from_chat_id,
             message_id=message_id,
-            sent_at=datetime.datetime.now(),
+            forward=forward,
+            admin_id=admin_id,
+            status=BroadcastStatus.RUNNING.value,
+            cursor=0,
+            total=total,
+            sent=0,
+            failed=0,
+            created_at=now,
+            updated_at=now,
         )
-        session.add(message_sent)
+        session.add(job)
+        session.commit()
+        session.refresh(job)
+        return job
+
+
+def update_broadcast_job(*, sent_id: str, **kwargs):
+    """
+    Update broadcast job, the checkpoint of the cursor and the counters or the status
+    :param sent_id: the sent id
+    :param kwargs: the data to update
+    """
+
+    kwargs["updated_at"] = datetime.datetime.now()
+    with get_session() as session:
+        session.query(BroadcastJob).filter(BroadcastJob.sent_id == sent_id).update(
+            kwargs
+        )
+        session.commit()
+
+
+def get_broadcast_job(*, sent_id: str) -> BroadcastJob | None:
+    """
+    Get broadcast job by sent id
+    :param sent_id: the sent id
+    :return: :class:`BroadcastJob`, None if there is no job with this sent id
+    """
+
+    with get_session() as session:
+        return (
+            session.query(BroadcastJob)
+            .filter(BroadcastJob.sent_id == sent_id)
+            .one_or_none()
+        )
+
+
+def get_running_broadcast_jobs() -> list[BroadcastJob]:
+    """Get the broadcast jobs that were running, to resume them"""
+
+    with get_session() as session:
+        return (
+            session.query(BroadcastJob)
+            .filter(BroadcastJob.status == BroadcastStatus.RUNNING.value)
+            .order_by(BroadcastJob.id)
+            .all()
+        )
+
+
+# message_sent
+
+
+def create_messages_sent_many(*, messages: list[dict]):
+    """
+    Create many messages sent in one bulk insert
+    :param messages: the rows, dicts with sent_id, chat_id, message_id and sent_at
+    """
+
+    _logger.debug(f"Create {len(messages)} messages sent")
+
+    with get_session() as session:
+        session.execute(insert(MessageSent), messages)
         session.commit()
-        return message_sent
 
 
 def get_messages_sent(*, sent_id: str) -> list[MessageSent]:
@@ -284,6 +599,77 @@ def get_messages_sent(*, sent_id: str) -> list[MessageSent]:
         return session.query(MessageSent).filter(MessageSent.sent_id == sent_id).all()
 
 
+def get_sent_chat_ids(*, sent_id: str, chat_ids: list[int]) -> set[int]:
+    """
+    Get the chats, out of the given chats, that already got the message
+    :param sent_id: the sent id
+    :param chat_ids: the chats to check
+    :return: set of chat ids
+    """
+
+    with get_session() as session:
+        return set(
+            session.scalars(
+                select(MessageSent.chat_id).where(
+                    MessageSent.sent_id == sent_id, MessageSent.chat_id.in_(chat_ids)
+                )
+            )
+        )
+
+
+def get_messages_to_delete_page(
+    *, sent_id: str, after: tuple[int, int] | None, limit: int
+) -> list[Row]:
+    """
+    Get a page of the messages sent that were not deleted yet, ordered by chat, so the
+    messages of a chat come together
+    :param sent_id: the sent id
+    :param after: the (chat_id, id) of the last message of the previous page, None for the first
+    :param limit: the maximum number of messages in the page
+    :return: list of rows with id, chat_id and message_id
+    """
+
+    with get_session() as session:
+        query = session.query(
+            MessageSent.id, MessageSent.chat_id, MessageSent.message_id
+        ).filter(
+            MessageSent.sent_id == sent_id, MessageSent.deleted == False  # noqa
+        )
+        if after is not None:
+            query = query.filter(
+                tuple_(MessageSent.chat_id, MessageSent.id) > tuple_(*after)
+            )
+        return query.order_by(MessageSent.chat_id, MessageSent.id).limit(limit).all()
+
+
+def get_messages_to_delete_count(*, sent_id: str) -> int:
+    """
+    Get the number of messages sent that were not deleted yet
+    :param sent_id: the sent id
+    :return: int
+    """
+
+    with get_session() as session:
+        return session.scalar(
+            select(func.count()).where(
+                MessageSent.sent_id == sent_id, MessageSent.deleted == False  # noqa
+            )
+        )
+
+
+def set_messages_sent_deleted(*, ids: list[int]):
+    """
+    Mark messages sent as deleted
+    :param ids: the ids of the rows
+    """
+
+    with get_session() as session:
+        session.query(MessageSent).filter(MessageSent.id.in_(ids)).update(
+            {MessageSent.deleted: True}
+        )
+        session.commit()
+
+
 def is_message_sent_exists(*, sent_id: str) -> bool:
     """
     Check if message sent exists
@@ -298,11 +684,73 @@ def is_message_sent_exists(*, sent_id: str) -> bool:
 def create_stats(*, type_stats: StatsType, lang: str):
     """Create stats"""
 
+    create_stats_many(
+        stats=[
+            dict(type=type_stats.value, lang=lang, created_at=datetime.datetime.now())
+        ]
+    )
+
+
+def create_stats_many(*, stats: list[dict]):
+    """
+    Create many stats in one bulk insert, and add them to the daily counts in the same transaction
+    :param stats: the rows, dicts with type, lang and created_at
+    """
+
+    daily = Counter(
+        (row["created_at"].date(), row["type"], row["lang"] or "") for row in stats
+    )
+    upsert = sqlite_insert(StatsDaily)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=[StatsDaily.day, StatsDaily.type, StatsDaily.lang],
+        set_=dict(count=StatsDaily.count + upsert.excluded.count),
+    )
+
     with get_session() as session:
-        stats = Stats(
-            type=type_stats.value,
-            lang=lang,
-            created_at=datetime.datetime.now(),
+        session.execute(insert(Stats), stats)
+        session.execute(
+            upsert,
+            [
+                dict(day=day, type=type_stats, lang=lang, count=count)
+                for (day, type_stats, lang), count in daily.items()
+            ],
         )
-        session.add(stats)
         session.commit()
+
+
+def get_usage_by_type(*, since: datetime.date) -> list[tuple[str, int]]:
+    """
+    Get the stats count per type from the daily counts
+    :param since: the first day to count
+    :return: list of (type, count), the most used first
+    """
+
+    with get_session() as session:
+        total = func.sum(StatsDaily.count)
+        return [
+            tuple(row)
+            for row in session.query(StatsDaily.type, total)
+            .filter(StatsDaily.day >= since)
+            .group_by(StatsDaily.type)
+            .order_by(total.desc())
+        ]
+
+
+def get_usage_by_lang(*, since: datetime.date, limit: int) -> list[tuple[str, int]]:
+    """
+    Get the stats count per language from the daily counts
+    :param since: the first day to count
+    :param limit: the maximum number of languages
+    :return: list of (lang, count), the most used first
+    """
+
+    with get_session() as session:
+        total = func.sum(StatsDaily.count)
+        return [
+            tuple(row)
+            for row in session.query(StatsDaily.lang, total)
+            .filter(StatsDaily.day >= since)
+            .group_by(StatsDaily.lang)
+            .order_by(total.desc())
+            .limit(limit)
+        ]
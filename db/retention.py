@@ -0,0 +1,175 @@
+# this file contains the retention job, that deletes the old stats and sent messages
+# in small chunks and gives the free pages back to the file system
+
+import datetime
+import logging
+import threading
+import time
+
+from sqlalchemy import delete, func, select, text
+
+from db.tables import engine, get_session, MessageSent, Stats
+from data import config
+
+
+_logger = logging.getLogger(__name__)
+
+settings = config.get_settings()
+
+
+def delete_older_than(
+    *, table, column, cutoff: datetime.datetime, stop: threading.Event | None = None
+) -> int:
+    """
+    Delete the rows that are older than the cutoff, one chunk per transaction
+    (the ids grow with the time, so a chunk is a range at the start of the primary key)
+    :param table: the table class, :class:`Stats` or :class:`MessageSent`
+    :param column: the time column of the table
+    :param cutoff: the rows older than this are deleted
+    :param stop: stop between the chunks when it is set
+    :return: the number of deleted rows
+    """
+
+    with get_session() as session:
+        boundary = session.scalar(select(func.max(table.id)).where(column < cutoff))
+    if boundary is None:
+        return 0
+
+    deleted = 0
+    while not (stop and stop.is_set()):
+        with get_session() as session:
+            chunk = (
+                select(table.id)
+                .where(table.id <= boundary)
+                .order_by(table.id)
+                .limit(settings.retention_chunk_size)
+                .scalar_subquery()
+            )
+            result = session.execute(
+                delete(table).where(table.id.in_(chunk), column < cutoff)
+            )
+            session.commit()
+        if not result.rowcount:
+            return deleted
+
+        deleted += result.rowcount
+        _logger.debug(f"Retention: {deleted} rows deleted from {table.__tablename__}")
+        time.sleep(settings.retention_chunk_pause)  # let the other writers in
+    return deleted
+
+
+def incremental_vacuum(stop: threading.Event | None = None) -> int:
+    """
+    Give the free pages of the database back to the file system, a few pages per transaction
+    :param stop: stop between the steps when it is set
+    :return: the number of pages that were freed
+    """
+
+    freed = 0
+    connection = engine.raw_connection()
+    try:
+        if connection.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:  # INCREMENTAL
+            _logger.warning(
+                "Retention: auto_vacuum is not INCREMENTAL, the free pages stay in the file "
+                "(set RETENTION_ENABLE_INCREMENTAL_VACUUM for one start to switch it)"
+            )
+            return 0
+        while not (stop and stop.is_set()) and (
+            pages := connection.execute("PRAGMA freelist_count").fetchone()[0]
+        ):
+            pages = min(pages, settings.retention_vacuum_pages)
+            # executescript runs the pragma to the end, execute frees only one page
+            connection.driver_connection.executescript(
+                f"PRAGMA incremental_vacuum({pages})"
+            )
+            freed += pages
+            time.sleep(settings.retention_chunk_pause)
+    finally:
+        connection.close()
+    return freed
+
+
+def enable_incremental_vacuum():
+    """
+    Switch a database that was created without auto_vacuum to INCREMENTAL,
+    this needs one full VACUUM that locks the database until it ends, so it runs at startup
+    before the bot, only when retention_enable_incremental_vacuum is set
+    """
+
+    # VACUUM can not run in a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        if connection.scalar(text("PRAGMA auto_vacuum")) == 2:
+            return
+        _logger.info("Retention: switching the database to auto_vacuum=INCREMENTAL")
+        start = time.perf_counter()
+        connection.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        connection.exec_driver_sql("VACUUM")
+        _logger.info(
+            f"Retention: the database was vacuumed in {time.perf_counter() - start:.1f} s"
+        )
+
+
+def run_retention(stop: threading.Event | None = None):
+    """
+    Delete the stats and the sent messages that are older than their windows
+    :param stop: stop between the chunks when it is set
+    """
+
+    start = time.perf_counter()
+    now = datetime.datetime.now()
+    deleted = {}
+    # the stats are already counted in stats_daily when they are written, so they can go
+    for table, column, days in (
+        (Stats, Stats.created_at, settings.retention_stats_days),
+        (MessageSent, MessageSent.sent_at, settings.retention_message_sent_days),
+    ):
+        if days:
+            deleted[table.__tablename__] = delete_older_than(
+                table=table,
+                column=column,
+                cutoff=now - datetime.timedelta(days=days),
+                stop=stop,
+            )
+
+    # the free pages stay for the next run when the bot is stopping
+    freed = 0 if stop and stop.is_set() else incremental_vacuum(stop)
+    _logger.info(
+        f"Retention: deleted {deleted}, freed {freed} pages "
+        f"in {time.perf_counter() - start:.1f} s"
+    )
+
+
+class RetentionJob:
+    """Run the retention every ``interval`` seconds in a background thread"""
+
+    def __init__(self, *, interval: float):
+        """
+        :param interval: the seconds between the runs, the first run is at the start
+        """
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        """Start the background thread"""
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                run_retention(stop=self._stop)
+            except Exception:  # noqa
+                _logger.exception("Retention: the run failed")
+            self._stop.wait(self._interval)
+
+    def stop(self, timeout: float | None = 10):
+        """
+        Stop the background thread, a run that is in the middle ends after its chunk
+        :param timeout: the maximum seconds to wait for the thread, it is a daemon
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                _logger.warning("Retention: the run did not stop in time, it is left")
@@ -0,0 +1,158 @@
+# this file contains the background writer of the usage stats.
+# the handlers only enqueue the stats, one long-lived thread writes them in bulk inserts
+
+import datetime
+import logging
+import queue
+import threading
+import time
+
+from db import repository
+from db.tables import StatsType
+from data import config
+
+
+_logger = logging.getLogger(__name__)
+
+settings = config.get_settings()
+
+_STOP = object()
+
+
+class StatsWriter:
+    """
+    Write the stats rows from a bounded queue, in one bulk insert per batch.
+
+    A batch is written when it reaches ``batch_size`` rows or when its first row waited
+    ``flush_interval`` seconds. When the queue is full the new rows are dropped (and counted),
+    the handlers never wait for the database.
+    """
+
+    def __init__(self, *, maxsize: int, batch_size: int, flush_interval: float):
+        """
+        :param maxsize: the maximum number of rows waiting in the queue
+        :param batch_size: the maximum number of rows in one insert
+        :param flush_interval: the maximum seconds a row waits for its batch
+        """
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+        self._closed = False
+
+        self.max_queue_depth = 0
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def put(self, *, type_stats: StatsType, lang: str | None):
+        """
+        Enqueue a stats row, the writer thread is started on the first row
+        :param type_stats: the type of the stats
+        :param lang: the language code of the user
+        """
+        if self._closed:
+            self.dropped += 1
+            return
+        if self._thread is None:
+            self._start()
+
+        try:
+            self._queue.put_nowait((type_stats.value, lang, datetime.datetime.now()))
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                _logger.warning(
+                    f"The stats queue is full, {self.dropped} rows dropped so far"
+                )
+            return
+
+        depth = self._queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="stats-writer", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        batch = []
+        deadline = 0.0
+        while True:
+            timeout = max(deadline - time.monotonic(), 0) if batch else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._flush(batch)
+                batch = []
+                continue
+
+            if item is _STOP:
+                self._flush(batch)
+                return
+
+            if not batch:
+                deadline = time.monotonic() + self._flush_interval
+            batch.append(item)
+            if len(batch) >= self._batch_size:
+                self._flush(batch)
+                batch = []
+
+    def _flush(self, batch: list[tuple]):
+        if not batch:
+            return
+        try:
+            repository.create_stats_many(
+                stats=[
+                    dict(type=type_stats, lang=lang, created_at=created_at)
+                    for type_stats, lang, created_at in batch
+                ]
+            )
+        except Exception:  # noqa
+            self.failed += len(batch)
+            _logger.exception(f"Failed to write {len(batch)} stats rows")
+            return
+        self.written += len(batch)
+        self.batches += 1
+
+    def stop(self, timeout: float | None = None):
+        """
+        Write the queued rows and stop the writer thread, the rows that are put later are dropped
+        :param timeout: the maximum seconds to wait for the writer
+        """
+        self._closed = True
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            _logger.warning(
+                f"The stats writer did not finish, {self._queue.qsize()} rows are lost"
+            )
+
+    def get_stats(self) -> dict[str, int]:
+        """
+        Get the counters of the writer
+        :return: dict with queue_depth, max_queue_depth, written, batches, dropped and failed
+        """
+        return dict(
+            queue_depth=self._queue.qsize(),
+            max_queue_depth=self.max_queue_depth,
+            written=self.written,
+            batches=self.batches,
+            dropped=self.dropped,
+            failed=self.failed,
+        )
+
+
+stats_writer = StatsWriter(
+    maxsize=settings.stats_queue_size,
+    batch_size=settings.stats_batch_size,
+    flush_interval=settings.stats_flush_interval,
+)
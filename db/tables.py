@@ -6,7 +6,15 @@ import datetime
 from contextlib import contextmanager
 from enum import Enum
 
-from sqlalchemy import String, create_engine, ForeignKey
+from sqlalchemy import (
+    String,
+    create_engine,
+    ForeignKey,
+    event,
+    UniqueConstraint,
+    Index,
+    text,
+)
 from sqlalchemy.orm import (
     Mapped,
     mapped_column,
@@ -14,18 +22,45 @@ from sqlalchemy.orm import (
     sessionmaker,
     relationship,
 )
+from sqlalchemy.pool import QueuePool
+
+from data import config
 
 
 _logger = logging.getLogger(__name__)
 
+settings = config.get_settings()
 
+# a single SQLite file: a few long-lived connections are enough, writers are serialized by SQLite
+# anyway, and every pooled connection keeps its page cache and memory map between the queries
 engine = create_engine(
-    url="sqlite:///bot_db.sqlite",
-    pool_size=20,
-    max_overflow=10,
+    url=f"sqlite:///{settings.sqlite_path}",
+    poolclass=QueuePool,
+    pool_size=settings.db_pool_size,
+    max_overflow=settings.db_max_overflow,
     pool_timeout=30,
 )
 
+
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, _):
+    """
+    Tune every new SQLite connection
+        - WAL: the readers (stats, lookups) do not wait for the writers (broadcasts, stats threads)
+        - synchronous=NORMAL: with WAL, an fsync per checkpoint instead of per commit
+    """
+    cursor = dbapi_connection.cursor()
+    # takes effect on a new database, so before the journal mode that creates the file.
+    # an existing one is switched by the retention, when it is enabled in the settings
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    cursor.execute(f"PRAGMA journal_mode={settings.sqlite_journal_mode}")
+    cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+    cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}")
+    cursor.execute(f"PRAGMA cache_size={int(settings.sqlite_cache_size)}")
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout)}")
+    cursor.execute(f"PRAGMA temp_store={settings.sqlite_temp_store}")
+    cursor.close()
+
 Session = sessionmaker(bind=engine)
 
 
@@ -57,6 +92,15 @@ class StatsType(Enum):
     LINK = "link"
 
 
+class BroadcastStatus(Enum):
+    """Status of a broadcast job"""
+
+    RUNNING = "running"
+    PAUSED = "paused"
+    DONE = "done"
+    CANCELLED = "cancelled"
+
+
 class BaseTable(DeclarativeBase):
     pass
 
@@ -65,15 +109,21 @@ class User(BaseTable):
     """User details"""
 
     __tablename__ = "user"
+    __table_args__ = (
+        # the active users (broadcast, counts), with the tg id so the index covers the recipients
+        Index("ix_user_active", "id", "tg_id", sqlite_where=text("active = 1")),
+        # the users per language of /stats
+        Index("ix_user_lang_active", "lang", "active"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     tg_id: Mapped[int] = mapped_column(unique=True)
     name: Mapped[str] = mapped_column(String(32))
     username: Mapped[str | None] = mapped_column(String(32))
-    business_id: Mapped[str | None] = mapped_column(String(32))
+    business_id: Mapped[str | None] = mapped_column(String(32), index=True)
     language_code: Mapped[str | None] = mapped_column(String(5))
     lang: Mapped[str | None] = mapped_column(String(5))  # lang in the bot
-    created_at: Mapped[datetime.datetime]
+    created_at: Mapped[datetime.datetime] = mapped_column(index=True)
     active: Mapped[bool] = mapped_column(default=True)
     admin: Mapped[bool] = mapped_column(default=False)
     groups: Mapped[list[Group]] = relationship(back_populates="added_by", lazy="joined")
@@ -83,6 +133,9 @@ class Group(BaseTable):
     """Group details"""
 
     __tablename__ = "group"
+    __table_args__ = (
+        Index("ix_group_active", "id", "group_id", sqlite_where=text("active = 1")),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     group_id: Mapped[int] = mapped_column(unique=True)
@@ -98,12 +151,15 @@ class MessageSent(BaseTable):
     """Sent message details"""
 
     __tablename__ = "message_sent"
+    __table_args__ = (Index("ix_message_sent_sent_id_chat_id", "sent_id", "chat_id"),)
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     sent_id: Mapped[str] = mapped_column(String(20))
     message_id: Mapped[int]
     chat_id: Mapped[int]
     sent_at: Mapped[datetime.datetime]
+    # set when the message was deleted with /delete, a retry skips it
+    deleted: Mapped[bool] = mapped_column(default=False)
 
 
 class Stats(BaseTable):
@@ -118,4 +174,35 @@ class Stats(BaseTable):
     created_at: Mapped[datetime.datetime]
 
 
-BaseTable.metadata.create_all(engine)
+class StatsDaily(BaseTable):
+    """Stats count per day, type and language, updated with every stats batch"""
+
+    __tablename__ = "stats_daily"
+    __table_args__ = (UniqueConstraint("day", "type", "lang"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    day: Mapped[datetime.date]
+    type: Mapped[StatsType] = mapped_column(String(32))
+    lang: Mapped[str] = mapped_column(String(5), default="")  # "" when unknown
+    count: Mapped[int] = mapped_column(default=0)
+
+
+class BroadcastJob(BaseTable):
+    """Broadcast job, the cursor and the counters are checkpointed while it runs"""
+
+    __tablename__ = "broadcast_job"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    sent_id: Mapped[str] = mapped_column(String(20), unique=True)
+    target: Mapped[str] = mapped_column(String(16))  # users / groups
+    from_chat_id: Mapped[int]  # the message to send
+    message_id: Mapped[int]
+    forward: Mapped[bool]  # forward with credit, or copy
+    admin_id: Mapped[int]  # the tg id of the admin that started it, gets the report
+    status: Mapped[BroadcastStatus] = mapped_column(String(16))
+    cursor: Mapped[int] = mapped_column(default=0)  # every recipient up to this id is done
+    total: Mapped[int]
+    sent: Mapped[int] = mapped_column(default=0)
+    failed: Mapped[int] = mapped_column(default=0)
+    created_at: Mapped[datetime.datetime]
+    updated_at: Mapped[datetime.datetime]
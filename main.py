@@ -1,10 +1,12 @@
 import logging
 from logging.handlers import RotatingFileHandler
-from pyrogram import Client, raw, __version__
+from pyrogram import Client, idle, raw, __version__
 
 from tg.handlers import HANDLERS
-from db import repository
-from data import config
+from tg import broadcast_jobs
+from db import repository, async_repository, retention, migrations
+from db.stats_writer import stats_writer
+from data import config, cache_memory
 
 
 # log config
@@ -41,24 +43,53 @@ app = Client(
 )
 
 
+async def run_bot():
+    """Run the bot until it is stopped, with the broadcasts that were running resumed"""
+    async with app:
+        await broadcast_jobs.resume_jobs(app)
+        await idle()
+        await broadcast_jobs.stop_jobs()
+
+
 def main():
     logging.info(
         f"The bot is up and running on Pyrogram v{__version__} (Layer {raw.all.layer})."
     )
 
+    migrations.migrate()
+
     for handler in HANDLERS:
         app.add_handler(handler)
 
+    cache_memory.cache_memory.restore(
+        path=settings.cache_snapshot_path, version=repository.SNAPSHOT_VERSION
+    )
+
+    if settings.retention_enable_incremental_vacuum:
+        retention.enable_incremental_vacuum()
+    retention_job = retention.RetentionJob(interval=settings.retention_interval)
+    retention_job.start()
+
     for admin in settings.admins:
-        if not repository.is_user_exists(tg_id=admin):
-            repository.create_user(
-                tg_id=admin, name="admin", admin=True, language_code="he"
-            )
-        else:
-            if not repository.is_admin(tg_id=admin):
-                repository.update_user(tg_id=admin, admin=True)
-
-    app.run()
+        repository.upsert_user(
+            tg_id=admin,
+            name="admin",
+            admin=True,
+            language_code="he",
+            update_profile=False,
+        )
+
+    try:
+        app.run(run_bot())
+    finally:
+        retention_job.stop()
+        async_repository.shutdown()
+        stats_writer.stop(timeout=30)
+        cache_memory.cache_memory.dump(
+            path=settings.cache_snapshot_path,
+            cache_names=repository.SNAPSHOT_CACHE_NAMES,
+            version=repository.SNAPSHOT_VERSION,
+        )
 
 
 if __name__ == "__main__":
@@ -1,26 +1,32 @@
-import io
+import datetime
 import logging
 import random
 import string
-import tempfile
-import asyncio  # Use asyncio for non-blocking sleep
-from pyrogram import Client, types, errors
+from typing import AsyncIterator, NamedTuple
 
-from db import repository
-from tg import filters
+from pyrogram import Client, types
+
+from db import async_repository
+from db.stats_writer import stats_writer
+from data import cache_memory
+from tg import filters, broadcast, broadcast_jobs
+from tg.progress import ProgressReporter
 
 _logger = logging.getLogger(__name__)
 
+# /delete deletes up to DELETE_BATCH messages of a chat in one call (the limit of telegram)
+DELETE_BATCH = 100
+DELETE_PAGE_SIZE = 1_000
+
 async def stats(_: Client, msg: types.Message):  # command /stats
     """
     Get the stats of the bot.
     """
-    users = repository.get_all_users_count()
-    users_active = repository.get_users_count_active()
-    business = repository.get_users_business_count()
-
-    groups = repository.get_all_groups_count()
-    groups_active = repository.get_groups_count_active()
+    bot_stats = await async_repository.get_bot_stats()
+    users = bot_stats["users"]
+    users_active = bot_stats["users_active"]
+    groups = bot_stats["groups"]
+    groups_active = bot_stats["groups_active"]
 
     text = (
         f"**Bot Statistics**\n"
@@ -28,13 +34,76 @@ async def stats(_: Client, msg: types.Message):  # command /stats
         f"Total: {users}\n"
         f"Active: {users_active}\n"
         f"Inactive: {users - users_active}\n"
-        f"Business users: {business}\n\n"
+        f"Business users: {bot_stats['business']}\n\n"
         f"**The number of groups in the bot are:** \n"
         f"Total: {groups}\n"
         f"Active: {groups_active}\n"
         f"Inactive: {groups - groups_active}\n"
     )
 
+    text += "\n**Users per language:** \n"
+    text += "".join(
+        f"{lang or 'unknown'}: {count} ({active} active)\n"
+        for lang, count, active in bot_stats["languages"]
+    )
+    text += "\n**New users per day:** \n"
+    text += "".join(f"{day}: {count}\n" for day, count in bot_stats["signups"])
+
+    writer = stats_writer.get_stats()
+    text += (
+        f"\n**Stats writer:** \n"
+        f"Queue: {writer['queue_depth']} (max {writer['max_queue_depth']})\n"
+        f"Written: {writer['written']} in {writer['batches']} batches\n"
+        f"Dropped: {writer['dropped']}, Failed: {writer['failed']}\n"
+    )
+
+    await msg.reply(text=text, quote=True)
+
+async def cache_stats(_: Client, msg: types.Message):  # command /cache [reset]
+    """
+    Get the memory cache stats of the bot, per cache name.
+    """
+    cache = cache_memory.cache_memory
+    if msg.command[1:] == ["reset"]:
+        cache.reset_stats()
+        await msg.reply(text="The cache stats have been reset", quote=True)
+        return
+
+    text = "**Cache Statistics**\n"
+    for cache_name, counters in cache.get_stats().items():
+        lookups = counters["hits"] + counters["misses"]
+        hit_rate = counters["hits"] / lookups * 100 if lookups else 0
+        calls = counters["calls"]
+        avg_call = counters["call_time"] / calls * 1000 if calls else 0
+        text += (
+            f"\n**{cache_name}**\n"
+            f"Size: {counters['size']}\n"
+            f"Hits: {counters['hits']}, Misses: {counters['misses']} "
+            f"({hit_rate:.1f}% hit rate)\n"
+            f"Sets: {counters['sets']}, Invalidations: {counters['invalidations']}\n"
+            f"Evictions: {counters['evictions']}, Expirations: {counters['expirations']}\n"
+            f"Calls: {counters['calls']}, Avg call: {avg_call:.2f} ms, "
+            f"Coalesced: {counters['coalesced']}\n"
+        )
+
+    await msg.reply(text=text, quote=True)
+
+async def usage(_: Client, msg: types.Message):  # command /usage [days]
+    """
+    Get the usage of the bot per type and per language, from the daily counts.
+    """
+    days = int(msg.command[1]) if msg.command[1:] and msg.command[1].isdigit() else 30
+    since = datetime.date.today() - datetime.timedelta(days=days - 1)
+
+    by_type = await async_repository.get_usage_by_type(since=since)
+    by_lang = await async_repository.get_usage_by_lang(since=since, limit=10)
+
+    text = f"**Usage in the last {days} days**\n"
+    text += f"Total: {sum(count for _, count in by_type)}\n\n**Per type:**\n"
+    text += "".join(f"{type_stats}: {count}\n" for type_stats, count in by_type)
+    text += "\n**Per language:**\n"
+    text += "".join(f"{lang or 'unknown'}: {count}\n" for lang, count in by_lang)
+
     await msg.reply(text=text, quote=True)
 
 async def ask_for_who_to_send(_: Client, msg: types.Message):
@@ -87,191 +156,101 @@ async def asq_message_for_subscribe(_: Client, msg: types.CallbackQuery):
         data={"send_message_to_subscribers": True, "data": send_to},
     )
 
-async def send_broadcast(_: Client, msg: types.Message):
+async def send_broadcast(client: Client, msg: types.Message):
     tg_id = msg.from_user.id
     send_to: str = filters.user_id_to_state.get(tg_id).get("data")
     filters.user_id_to_state.pop(tg_id)
 
     match send_to:
         case "users":
-            users = repository.get_all_users_active()
-            chats = None
+            total = await async_repository.get_users_count_active()
         case "groups":
-            chats = repository.get_all_groups_active()
-            users = None
+            total = await async_repository.get_groups_count_active()
         case _:
             return
 
-    log_obj = io.StringIO()
-    sent = 0
-    failed = 0
-    count = 0
-    count_edit = 0
-
     while True:
         sent_id = "".join(random.choices(string.ascii_letters + string.digits, k=10))
-        if not repository.is_message_sent_exists(sent_id=sent_id):
+        if not await async_repository.get_broadcast_job(sent_id=sent_id):
             break
 
+    job = await async_repository.create_broadcast_job(
+        sent_id=sent_id,
+        target=send_to,
+        from_chat_id=msg.chat.id,
+        message_id=msg.id,
+        forward=bool(msg.forward_origin),
+        admin_id=tg_id,
+        total=total,
+    )
+
     await msg.reply(
-        text=f"**📣 Starting to send to:** {len((chats if chats is not None else users))} chats\nPlease wait...\n"
-        f"> Sending ID: `{sent_id}` You can use it to delete the sent messages with the command `/delete {sent_id}`",
+        text=f"**📣 Starting to send to:** {total} chats\nPlease wait...\n"
+        f"> Sending ID: `{sent_id}` You can use it to delete the sent messages with the command `/delete {sent_id}`\n"
+        f"> You can pause, resume or cancel it with `/pause {sent_id}`, `/resume {sent_id}` and `/cancel {sent_id}`",
     )
 
-    progress = await msg.reply(text=f"**Message sent to:** {sent} chats")
-
-    if users is not None:  # send to users
-        for user in users:
-            if count > 40:
-                count = 0
-                await asyncio.sleep(3)  # Non-blocking sleep
-            try:
-                if msg.forward_origin:
-                    msg_sent = await msg.forward(chat_id=user.tg_id)
-                else:
-                    msg_sent = await msg.copy(chat_id=user.tg_id)
-                sent += 1
-
-                repository.create_message_sent(
-                    sent_id=sent_id, chat_id=user.tg_id, message_id=msg_sent.id
-                )
-
-                # Log success
-                text_log = (
-                    f"sent to user: {user.tg_id}, name: {user.name}, "
-                    f"language_code: {user.language_code}, username: {user.username}\n"
-                )
-                log_obj.write(text_log)
-                _logger.debug(text_log)
-
-                # Update progress every 10 messages sent
-                if sent % 10 == 0:
-                    await progress.edit_text(
-                        text=f"**The message has been sent to:** {sent} chats",
-                    )
+    # the job runs in the background, so the handler is free and the admin can pause it
+    broadcast_jobs.start(client, job)
 
-                count += 1
-                await asyncio.sleep(0.05)  # Non-blocking sleep
-
-            except errors.FloodWait as e:
-                _logger.error(f"FloodWait: {e.value}")
-                await asyncio.sleep(e.value)
-
-            except errors.InputUserDeactivated:
-                repository.update_user(tg_id=user.tg_id, active=False)
-                text_log = (
-                    f"user {user.tg_id}, name: {user.name} "
-                    f"language_code: {user.language_code}, username: {user.username} is Deactivated\n"
-                )
-                log_obj.write(text_log)
-                _logger.debug(text_log)
-                failed += 1
-
-            except errors.UserIsBlocked:
-                repository.update_user(tg_id=user.tg_id, active=False)
-                text_log = (
-                    f"user {user.tg_id}, name: {user.name} "
-                    f"language_code: {user.language_code}, username: {user.username} Blocked your bot\n"
-                )
-                log_obj.write(text_log)
-                _logger.debug(text_log)
-                failed += 1
-
-            except errors.PeerIdInvalid:
-                repository.update_user(tg_id=user.tg_id, active=False)
-                text_log = (
-                    f"user {user.tg_id}, name: {user.name} "
-                    f"language_code: {user.language_code}, username: {user.username} IdInvalid\n"
-                )
-                log_obj.write(text_log)
-                _logger.debug(text_log)
-                failed += 1
-
-            except errors.BadRequest as e:
-                repository.update_user(tg_id=user.tg_id, active=False)
-                text_log = (
-                    f"BadRequest: {e} : user {user.tg_id}, name: {user.name} "
-                    f"language_code: {user.language_code}, username: {user.username}"
-                )
-                log_obj.write(text_log)
-                _logger.debug(text_log)
-                failed += 1
-
-    if chats is not None:  # send to chats
-        for chat in chats:
-            if count > 40:
-                count = 0
-                await asyncio.sleep(3)
-            try:
-                if msg.forward_origin:
-                    msg_sent = await msg.forward(chat_id=chat.group_id)
-                else:
-                    msg_sent = await msg.copy(chat_id=chat.group_id)
-                sent += 1
-
-                repository.create_message_sent(
-                    sent_id=sent_id, chat_id=chat.group_id, message_id=msg_sent.id
-                )
-
-                # Log success
-                text_log = f"sent to chat: {chat.group_id}, name: {chat.name}, username: {chat.username}\n"
-                log_obj.write(text_log)
-                _logger.debug(text_log)
-
-                # Update progress every 10 messages sent
-                if sent % 10 == 0:
-                    await progress.edit_text(
-                        text=f"**ההודעה נשלחה ל:** {sent} צ'אטים",
-                    )
+async def control_broadcast(client: Client, msg: types.Message):  # command /pause, /resume, /cancel
+    """
+    Pause, resume or cancel a broadcast by its sent id.
+    """
+    try:
+        sent_id = msg.command[1]
+    except IndexError:
+        await msg.reply("Message ID not found")
+        return
 
-                count += 1
-                await asyncio.sleep(0.05)
-
-            except errors.FloodWait as e:
-                _logger.error(f"FloodWait: {e.value}")
-                await asyncio.sleep(e.value)
-
-            except errors.BadRequest as e:
-                repository.update_group(group_id=chat.group_id, active=False)
-                text_log = f"BadRequest: {e}, chat_id: {chat.group_id}, name: {chat.name}, username: {chat.username}"
-                log_obj.write(text_log)
-                _logger.debug(text_log)
-                failed += 1
-
-    # Send report at the end of the broadcast
-    await send_report(_, msg, sent, failed, sent_id, log_obj, repository)
-
-# Function to send a report message
-async def send_report(client: Client, msg: types.Message, sent, failed, sent_id, log_obj, repository):
-    text_done = (
-        f"📣 Sending completed\n\n"
-        f"🔹 The message was sent to: {sent} chats\n"
-        f"🔹 The message failed in: {failed} chats"
-        f"\n\n🔹 Sending ID: {sent_id}\n"
-        f"🔹 Sent on: {time.strftime('%d/%m/%Y')}\n"
-        f"🔹 Sent at: {time.strftime('%H:%M:%S')}\n"
-        f"\nYou can delete the messages by sending the command `/delete {sent_id}`"
-    )
+    match msg.command[0]:
+        case "pause":
+            done = await broadcast_jobs.pause(sent_id)
+            text = "The sending has been paused" if done else "No running sending with this ID"
+        case "resume":
+            done = await broadcast_jobs.resume(client, sent_id)
+            text = "The sending has been resumed" if done else "No paused sending with this ID"
+        case _:
+            done = await broadcast_jobs.cancel(sent_id)
+            text = "The sending has been cancelled" if done else "No running or paused sending with this ID"
 
-    # Log the report
-    text_log = f"\n\nSent: {sent}, Failed: {failed}\n Sent_id: {sent_id}\n\n"
-    log_obj.write(text_log)
-    _logger.debug(text_log)
+    await msg.reply(text=text, quote=True)
 
-    # Save log to a temporary file
-    with tempfile.TemporaryFile(delete=False) as temp_file:
-        # Write log to file
-        temp_file.write(log_obj.getvalue().encode())
-        temp_file.flush()
-        temp_file_path = temp_file.name
+# Function to delete sent messages
+class _DeleteBatch(NamedTuple):
+    """Messages of one chat that are deleted in one call"""
+
+    chat_id: int
+    message_ids: list[int]
+    ids: list[int]  # the rows of the messages
+
+
+async def _delete_batches(sent_id: str) -> AsyncIterator[_DeleteBatch]:
+    """
+    Stream the messages that are left to delete, page by page, grouped by chat
+    in batches of up to DELETE_BATCH messages
+    """
+    after = None
+    batch = None
+    while rows := await async_repository.get_messages_to_delete_page(
+        sent_id=sent_id, after=after, limit=DELETE_PAGE_SIZE
+    ):
+        for row in rows:
+            if (
+                batch is None
+                or batch.chat_id != row.chat_id
+                or len(batch.ids) == DELETE_BATCH
+            ):
+                if batch is not None:
+                    yield batch
+                batch = _DeleteBatch(chat_id=row.chat_id, message_ids=[], ids=[])
+            batch.message_ids.append(row.message_id)
+            batch.ids.append(row.id)
+        after = (rows[-1].chat_id, rows[-1].id)
+    if batch is not None:
+        yield batch
 
-        try:
-            await msg.reply_document(document=temp_file_path, caption=text_done)
-        except Exception as e:
-            _logger.exception(e)
-            await msg.reply(f"```py\n{e}```")
 
-# Function to delete sent messages
 async def delete_sent_messages(client: Client, msg: types.Message):
     """
     Delete sent messages.
@@ -284,35 +263,44 @@ async def delete_sent_messages(client: Client, msg: types.Message):
         return
 
     # Validate the sent ID
-    if not repository.is_message_sent_exists(sent_id=sent_id):
+    if not await async_repository.is_message_sent_exists(sent_id=sent_id):
         await msg.reply("The ID is not valid")
         return
 
-    sent_messages = repository.get_messages_sent(sent_id=sent_id)
-    await msg.reply(f"Deleting {len(sent_messages)} sent messages")
-
-    count = 0
-    delete = 0
-    for sent_message in sent_messages:
-        if count > 40:
-            count = 0
-            await asyncio.sleep(3)  # Non-blocking sleep after 40 messages
-
-        try:
-            await client.delete_messages(
-                chat_id=sent_message.chat_id, message_ids=sent_message.message_id
-            )
-            count += 1
-            await asyncio.sleep(0.05)
-            delete += 1
-
-        except errors.FloodWait as e:
-            _logger.error(f"FloodWait: {e.value}")
-            await asyncio.sleep(e.value)
-
-        except Exception as e:
-            _logger.error(
-                f"Error: {e}, chat_id: {sent_message.chat_id}, message_id: {sent_message.message_id}"
-            )
-
-    await msg.reply(f"Deleted {delete} messages")
+    total = await async_repository.get_messages_to_delete_count(sent_id=sent_id)
+    if not total:
+        await msg.reply("The messages were already deleted")
+        return
+    progress = ProgressReporter(
+        title=f"Deleting the messages of {sent_id}", total=total, done_label="Deleted"
+    )
+    progress.start(await msg.reply(progress.render()))
+
+    async def delete(batch: _DeleteBatch) -> int:
+        return await client.delete_messages(
+            chat_id=batch.chat_id, message_ids=batch.message_ids
+        )
+
+    async def on_deleted(batch: _DeleteBatch, _):
+        # a retry of /delete skips the deleted messages
+        await async_repository.set_messages_sent_deleted(ids=batch.ids)
+        progress.update(done=progress.done + len(batch.ids), failed=progress.failed)
+
+    async def on_error(batch: _DeleteBatch, e: Exception):
+        progress.update(done=progress.done, failed=progress.failed + len(batch.ids))
+        _logger.error(
+            f"Error: {e}, chat_id: {batch.chat_id}, message_ids: {batch.message_ids}"
+        )
+
+    # the deletions are paced like a broadcast, with the same FloodWait handling
+    sender = broadcast.Broadcast(send=delete, on_sent=on_deleted, on_error=on_error)
+    note = f"Stopped by an error, send /delete {sent_id} to continue"
+    try:
+        await sender.run(_delete_batches(sent_id))
+        note = (
+            f"Done, send /delete {sent_id} to retry the failed"
+            if progress.failed
+            else "Done"
+        )
+    finally:
+        await progress.stop(note=note)
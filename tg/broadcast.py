@@ -0,0 +1,220 @@
+# this file contains the broadcast engine: a pool of workers that send to the chats,
+# paced by one token bucket that slows down when telegram answers with FloodWait
+
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+from pyrogram import errors
+
+from data import config
+
+
+_logger = logging.getLogger(__name__)
+
+settings = config.get_settings()
+
+
+class TokenBucket:
+    """
+    Allow ``rate`` sends per second on average, with bursts of up to ``burst`` sends.
+    The waiting senders are served in order.
+    """
+
+    def __init__(self, *, rate: float, burst: int):
+        """
+        :param rate: the tokens added per second
+        :param burst: the maximum tokens in the bucket
+        """
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Wait for a token"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    @property
+    def paused(self) -> bool:
+        """Check if the bucket is in a pause"""
+        return time.monotonic() < self._paused_until
+
+    def pause(self, seconds: float):
+        """
+        Give no tokens for the next seconds, and start empty after them
+        :param seconds: the pause
+        """
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + seconds)
+        self._tokens = 0.0
+        self._updated = self._paused_until
+
+
+class Broadcast:
+    """
+    Send to many chats with a bounded pool of workers, paced by a :class:`TokenBucket`.
+
+    The rate adapts (AIMD): a FloodWait pauses the bucket for the wait and multiplies the rate
+    by ``decrease``, every second of sends without a FloodWait adds ``increase`` to it, up to
+    the start rate. A chat that got a FloodWait is retried after the wait plus its own
+    exponential backoff, up to ``max_attempts`` sends.
+    """
+
+    def __init__(
+        self,
+        *,
+        send: Callable[[Any], Awaitable[Any]],
+        on_sent: Callable[[Any, Any], Awaitable[None]],
+        on_error: Callable[[Any, Exception], Awaitable[None]],
+        rate: float = settings.broadcast_rate,
+        min_rate: float = settings.broadcast_min_rate,
+        workers: int = settings.broadcast_workers,
+        max_attempts: int = 5,
+        backoff: float = 1.0,
+        decrease: float = 0.7,
+        increase: float = 1.0,
+    ):
+        """
+        :param send: send to the chat (the recipient as given), return the sent message
+        :param on_sent: called with the recipient and the sent message
+        :param on_error: called with the recipient and the error, when the send failed for good
+        :param rate: the start (and the maximum) sends per second
+        :param min_rate: the rate never goes below it
+        :param workers: the maximum concurrent sends
+        :param max_attempts: the maximum sends to one chat
+        :param backoff: the first extra wait of a chat after a FloodWait, doubled every retry
+        :param decrease: the rate is multiplied by it on a FloodWait
+        :param increase: the rate is increased by it after every second without a FloodWait
+        """
+        self._send = send
+        self._on_sent = on_sent
+        self._on_error = on_error
+        self._max_rate = rate
+        self._min_rate = min_rate
+        self._workers = workers
+        self._max_attempts = max_attempts
+        self._backoff = backoff
+        self._decrease = decrease
+        self._increase = increase
+        # no bursts, the sends are spread evenly so any one second stays under the rate
+        self.bucket = TokenBucket(rate=rate, burst=1)
+
+        self.sent = 0
+        self.failed = 0
+        self.flood_waits = 0
+        self.cancelled = False
+        self._last_change = time.monotonic()
+        self._running = asyncio.Event()
+        self._running.set()
+
+    @property
+    def rate(self) -> float:
+        """The current sends per second"""
+        return self.bucket.rate
+
+    @property
+    def paused(self) -> bool:
+        """Check if the broadcast is paused"""
+        return not self._running.is_set()
+
+    def pause(self):
+        """Stop sending, the sends that are in flight still finish"""
+        self._running.clear()
+
+    def resume(self):
+        """Continue sending after a pause"""
+        self._running.set()
+
+    def cancel(self):
+        """Stop sending, the recipients that were not sent yet are dropped"""
+        self.cancelled = True
+        self._running.set()
+
+    def _on_flood_wait(self, seconds: float):
+        self.flood_waits += 1
+        # the other sends that were in flight get their FloodWait too, slow down once for them
+        if not self.bucket.paused:
+            self.bucket.rate = max(self._min_rate, self.bucket.rate * self._decrease)
+        self.bucket.pause(seconds)
+        self._last_change = time.monotonic() + seconds
+        _logger.warning(
+            f"Broadcast: FloodWait of {seconds} s, the rate is now {self.bucket.rate:.1f}/s"
+        )
+
+    def _on_success(self):
+        now = time.monotonic()
+        if self.bucket.rate < self._max_rate and now - self._last_change >= 1:
+            self.bucket.rate = min(self._max_rate, self.bucket.rate + self._increase)
+            self._last_change = now
+
+    async def _deliver(self, recipient: Any):
+        for attempt in range(self._max_attempts):
+            await self._running.wait()
+            if self.cancelled:
+                return
+            await self.bucket.acquire()
+            try:
+                message = await self._send(recipient)
+            except errors.FloodWait as e:
+                self._on_flood_wait(e.value)
+                if attempt + 1 == self._max_attempts:
+                    self.failed += 1
+                    await self._on_error(recipient, e)
+                    return
+                await asyncio.sleep(e.value + self._backoff * 2**attempt)
+                continue
+            except Exception as e:  # noqa
+                self.failed += 1
+                await self._on_error(recipient, e)
+                return
+
+            self._on_success()
+            self.sent += 1
+            await self._on_sent(recipient, message)
+            return
+
+    async def _worker(self, queue: asyncio.Queue):
+        while (recipient := await queue.get()) is not None:
+            try:
+                await self._deliver(recipient)
+            except Exception:  # noqa, a failing callback must not stop the worker
+                _logger.exception(f"Broadcast: failed to handle {recipient}")
+
+    async def run(self, recipients: AsyncIterator[Any]):
+        """
+        Send to all the recipients, and return when every send is done
+        :param recipients: the recipients, read only as fast as the workers need them
+        """
+        queue = asyncio.Queue(maxsize=self._workers * 2)
+        workers = [
+            asyncio.create_task(self._worker(queue)) for _ in range(self._workers)
+        ]
+        try:
+            async for recipient in recipients:
+                if self.cancelled:
+                    break
+                await queue.put(recipient)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
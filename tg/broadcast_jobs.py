@@ -0,0 +1,473 @@
+# this file contains the broadcast jobs: a broadcast is saved as a job row, its cursor and
+# counters are checkpointed while it runs, so it can be paused, cancelled, and resumed after a restart
+
+import asyncio
+import datetime
+import io
+import logging
+import time
+from collections import deque
+from typing import Any, AsyncIterator
+
+from pyrogram import Client, types, errors
+
+from db import async_repository
+from db.tables import BroadcastJob, BroadcastStatus
+from tg import broadcast
+from tg.progress import ProgressReporter
+from data import config
+
+
+_logger = logging.getLogger(__name__)
+
+settings = config.get_settings()
+
+# the checkpoint of a running job is written every CHECKPOINT_EVERY recipients
+# or CHECKPOINT_INTERVAL seconds, whichever comes first
+CHECKPOINT_EVERY = 100
+CHECKPOINT_INTERVAL = 5.0
+PAGE_SIZE = 1_000
+STOPPED_NOTE = "Stopped with the bot, it continues after the restart"
+
+# the jobs that run in this process, by sent id
+_jobs: dict[str, "JobRunner"] = {}
+
+
+class _Cursor:
+    """
+    The id up to which every recipient is done, the recipients are sent concurrently
+    so they finish out of order
+    """
+
+    def __init__(self, start: int):
+        self.value = start
+        self._pending = deque()
+        self._done = set()
+
+    def started(self, recipient_id: int):
+        self._pending.append(recipient_id)
+
+    def finished(self, recipient_id: int):
+        self._done.add(recipient_id)
+        while self._pending and self._pending[0] in self._done:
+            self.value = self._pending.popleft()
+            self._done.remove(self.value)
+
+
+class _SentRecorder:
+    """
+    Record the sent messages in bulk inserts, when ``batch`` rows are waiting
+    or every ``interval`` seconds
+    """
+
+    def __init__(self, *, sent_id: str, batch: int, interval: float):
+        """
+        :param sent_id: the sent id of the job
+        :param batch: the rows that trigger a flush
+        :param interval: the maximum seconds a row waits
+        """
+        self._sent_id = sent_id
+        self._batch = batch
+        self._interval = interval
+        self._rows: list[dict] = []
+        self._timer: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    async def add(self, *, chat_id: int, message_id: int):
+        self._rows.append(
+            dict(
+                sent_id=self._sent_id,
+                chat_id=chat_id,
+                message_id=message_id,
+                sent_at=datetime.datetime.now(),
+            )
+        )
+        if len(self._rows) >= self._batch:
+            await self.flush()
+
+    async def flush(self):
+        """
+        Write the waiting rows, and wait for a write that is in flight, so every row that was
+        added before is saved when it returns. The rows are kept if the write fails.
+        """
+        async with self._lock:
+            if not self._rows:
+                return
+            rows, self._rows = self._rows, []
+            try:
+                await async_repository.create_messages_sent_many(messages=rows)
+            except BaseException:
+                self._rows[:0] = rows
+                raise
+
+    async def _flush_every_interval(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                await self.flush()
+            except Exception:  # noqa
+                _logger.exception(f"Failed to record the messages of {self._sent_id}")
+
+    def start(self):
+        self._timer = asyncio.create_task(self._flush_every_interval())
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+
+
+class JobRunner:
+    """Run a broadcast job, from its last checkpoint"""
+
+    def __init__(self, *, client: Client, job: BroadcastJob, resumed: bool = False):
+        """
+        :param client: the bot client
+        :param job: the job row
+        :param resumed: the job was loaded from the database, some chats may have the message
+        """
+        self.client = client
+        self.job = job
+        self.sent = job.sent
+        self.failed = job.failed
+        # the messages are recorded before the first checkpoint, so the counters of the job
+        # can not tell if a job that was loaded from the database sent to some chats
+        self.resumed = resumed
+        self.sender = broadcast.Broadcast(
+            send=self._send, on_sent=self._on_sent, on_error=self._on_error
+        )
+        self.task: asyncio.Task | None = None
+        self.stopping = False
+
+        self._cursor = _Cursor(job.cursor)
+        self._log = io.StringIO()
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+        self._progress = ProgressReporter(
+            title=f"Broadcast {job.sent_id}",
+            total=job.total,
+            done=job.sent,
+            failed=job.failed,
+        )
+        self._recorder = _SentRecorder(
+            sent_id=job.sent_id,
+            batch=settings.broadcast_record_batch,
+            interval=settings.broadcast_record_interval,
+        )
+
+    @property
+    def users(self) -> bool:
+        return self.job.target == "users"
+
+    def _chat_id(self, recipient) -> int:
+        return recipient.tg_id if self.users else recipient.group_id
+
+    async def _recipients(self) -> AsyncIterator[Any]:
+        """The recipients after the cursor, without the chats that already got the message"""
+        get_page = (
+            async_repository.get_active_users_page
+            if self.users
+            else async_repository.get_active_groups_page
+        )
+        after_id = self.job.cursor
+        while page := await get_page(after_id=after_id, limit=PAGE_SIZE):
+            after_id = page[-1].id
+            # a resumed job may have sent to some chats after its last checkpoint
+            already_sent = (
+                await async_repository.get_sent_chat_ids(
+                    sent_id=self.job.sent_id,
+                    chat_ids=[self._chat_id(recipient) for recipient in page],
+                )
+                if self.resumed
+                else set()
+            )
+            for recipient in page:
+                if self._chat_id(recipient) in already_sent:
+                    continue
+                self._cursor.started(recipient.id)
+                yield recipient
+
+    async def _send(self, recipient) -> types.Message:
+        if self.job.forward:
+            return await self.client.forward_messages(
+                chat_id=self._chat_id(recipient),
+                from_chat_id=self.job.from_chat_id,
+                message_ids=self.job.message_id,
+            )
+        return await self.client.copy_message(
+            chat_id=self._chat_id(recipient),
+            from_chat_id=self.job.from_chat_id,
+            message_id=self.job.message_id,
+        )
+
+    async def _on_sent(self, recipient, msg_sent: types.Message):
+        await self._recorder.add(
+            chat_id=self._chat_id(recipient), message_id=msg_sent.id
+        )
+        self.sent += 1
+
+        # Log success
+        if self.users:
+            text_log = (
+                f"sent to user: {recipient.tg_id}, name: {recipient.name}, "
+                f"language_code: {recipient.language_code}, username: {recipient.username}\n"
+            )
+        else:
+            text_log = f"sent to chat: {recipient.group_id}, name: {recipient.name}, username: {recipient.username}\n"
+        self._write_log(text_log)
+        self._progress.update(done=self.sent, failed=self.failed)
+        await self._finished(recipient)
+
+    async def _on_error(self, recipient, e: Exception):
+        self.failed += 1
+        if self.users:
+            user_text = (
+                f"user {recipient.tg_id}, name: {recipient.name} "
+                f"language_code: {recipient.language_code}, username: {recipient.username}"
+            )
+            match e:
+                case errors.InputUserDeactivated():
+                    text_log = f"{user_text} is Deactivated\n"
+                case errors.UserIsBlocked():
+                    text_log = f"{user_text} Blocked your bot\n"
+                case errors.PeerIdInvalid():
+                    text_log = f"{user_text} IdInvalid\n"
+                case errors.BadRequest():
+                    text_log = f"BadRequest: {e} : {user_text}\n"
+                case _:
+                    text_log = f"Error: {e} : {user_text}\n"
+            # the errors that mean the user can not get messages anymore
+            if isinstance(e, (errors.UserIsBlocked, errors.BadRequest)):
+                await async_repository.update_user(tg_id=recipient.tg_id, active=False)
+        else:
+            text_log = f"{type(e).__name__}: {e}, chat_id: {recipient.group_id}, name: {recipient.name}, username: {recipient.username}\n"
+            if isinstance(e, errors.BadRequest):
+                await async_repository.update_group(
+                    group_id=recipient.group_id, active=False
+                )
+        self._write_log(text_log)
+        self._progress.update(done=self.sent, failed=self.failed)
+        await self._finished(recipient)
+
+    def _write_log(self, text_log: str):
+        self._log.write(text_log)
+        _logger.debug(text_log)
+
+    async def _finished(self, recipient):
+        self._cursor.finished(recipient.id)
+        self._unsaved += 1
+        if (
+            self._unsaved >= CHECKPOINT_EVERY
+            or time.monotonic() - self._saved_at >= CHECKPOINT_INTERVAL
+        ):
+            await self.checkpoint()
+
+    async def checkpoint(self, **kwargs):
+        """
+        Save the cursor and the counters of the job, after the sent messages that they count
+        (a resumed job skips the recorded chats)
+        :param kwargs: more data to update, like the status
+        """
+        # the values before the flush, the workers keep sending while it waits, and the
+        # messages they add are not in this flush
+        cursor, sent, failed = self._cursor.value, self.sent, self.failed
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+        await self._recorder.flush()
+        await async_repository.update_broadcast_job(
+            sent_id=self.job.sent_id, cursor=cursor, sent=sent, failed=failed, **kwargs
+        )
+
+    async def run(self):
+        """Send to the recipients that are left, then save the job as done and send the report"""
+        note = "Stopped by an error, see the logs"
+        try:
+            try:
+                self._progress.start(
+                    await self.client.send_message(
+                        chat_id=self.job.admin_id, text=self._progress.render()
+                    )
+                )
+                self._recorder.start()
+                await self.sender.run(self._recipients())
+            except asyncio.CancelledError:
+                # the bot is stopping, the job stays running and is resumed on the next start
+                note = STOPPED_NOTE
+                await self.checkpoint()
+                raise
+            except Exception:  # noqa
+                # paused, so the admin can /resume or /cancel it, it is not resumed on a start
+                _logger.exception(f"Broadcast {self.job.sent_id} failed")
+                await self.checkpoint(status=BroadcastStatus.PAUSED.value)
+                note = (
+                    "Paused by an error, see the logs. "
+                    f"/resume {self.job.sent_id} to continue"
+                )
+                return
+            finally:
+                self._recorder.stop()
+                _jobs.pop(self.job.sent_id, None)
+
+            if self.stopping:
+                # the bot is stopping, the job keeps its status and is resumed on the next start
+                note = STOPPED_NOTE
+                await self.checkpoint()
+                _logger.info(
+                    f"Broadcast {self.job.sent_id} stopped after {self._cursor.value}"
+                )
+                return
+
+            status = (
+                BroadcastStatus.CANCELLED
+                if self.sender.cancelled
+                else BroadcastStatus.DONE
+            )
+            await self.checkpoint(status=status.value)
+            note = status.value.capitalize()
+        finally:
+            # on every path, also when a checkpoint fails, or the editor would run forever
+            await self._progress.stop(note=note)
+
+        _logger.info(
+            f"Broadcast {self.job.sent_id} {status.value}: sent {self.sent}, failed {self.failed}, "
+            f"{self.sender.flood_waits} FloodWaits, final rate {self.sender.rate:.1f}/s"
+        )
+        await self.send_report(status)
+
+    async def send_report(self, status: BroadcastStatus):
+        sent_id = self.job.sent_id
+        text_done = (
+            f"📣 Sending {'completed' if status == BroadcastStatus.DONE else 'cancelled'}\n\n"
+            f"🔹 The message was sent to: {self.sent} chats\n"
+            f"🔹 The message failed in: {self.failed} chats"
+            f"\n\n🔹 Sending ID: {sent_id}\n"
+            f"🔹 Sent on: {time.strftime('%d/%m/%Y')}\n"
+            f"🔹 Sent at: {time.strftime('%H:%M:%S')}\n"
+            f"\nYou can delete the messages by sending the command `/delete {sent_id}`"
+        )
+
+        # Log the report
+        text_log = f"\n\nSent: {self.sent}, Failed: {self.failed}\n Sent_id: {sent_id}\n\n"
+        self._write_log(text_log)
+
+        # Send the log as a file
+        log_file = io.BytesIO(self._log.getvalue().encode())
+        log_file.name = f"broadcast_{sent_id}.txt"
+        try:
+            await self.client.send_document(
+                chat_id=self.job.admin_id, document=log_file, caption=text_done
+            )
+        except Exception as e:
+            _logger.exception(e)
+            await self.client.send_message(
+                chat_id=self.job.admin_id, text=f"```py\n{e}```"
+            )
+
+
+def start(client: Client, job: BroadcastJob, resumed: bool = False) -> JobRunner:
+    """
+    Run the job in the background
+    :param client: the bot client
+    :param job: the job row
+    :param resumed: the job was loaded from the database, skip the chats that got the message
+    :return: :class:`JobRunner`
+    """
+    runner = JobRunner(client=client, job=job, resumed=resumed)
+    runner.task = asyncio.create_task(runner.run())
+    _jobs[job.sent_id] = runner
+    return runner
+
+
+def get_running(sent_id: str) -> JobRunner | None:
+    """Get the runner of a job that runs in this process"""
+    return _jobs.get(sent_id)
+
+
+async def resume_jobs(client: Client):
+    """Resume the jobs that were running when the bot stopped"""
+    for job in await async_repository.get_running_broadcast_jobs():
+        _logger.info(
+            f"Resuming broadcast {job.sent_id} after {job.cursor} "
+            f"(sent {job.sent}, failed {job.failed} of {job.total})"
+        )
+        start(client, job, resumed=True)
+
+
+async def stop_jobs(timeout: float = 10):
+    """
+    Stop the running jobs at their checkpoint, they are resumed on the next start
+    :param timeout: the seconds to wait for the sends in flight, then the jobs are cancelled
+    """
+    runners = list(_jobs.values())
+    if not runners:
+        return
+    for runner in runners:
+        runner.stopping = True
+        runner.sender.cancel()
+    tasks = [runner.task for runner in runners]
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def pause(sent_id: str) -> bool:
+    """
+    Pause a running job
+    :param sent_id: the sent id
+    :return: False if the job is not running
+    """
+    runner = _jobs.get(sent_id)
+    if runner is None or runner.sender.paused:
+        return False
+    runner.sender.pause()
+    await runner.checkpoint(status=BroadcastStatus.PAUSED.value)
+    return True
+
+
+async def resume(client: Client, sent_id: str) -> bool:
+    """
+    Resume a paused job, also one that was paused before a restart
+    :param client: the bot client
+    :param sent_id: the sent id
+    :return: False if the job is not paused
+    """
+    runner = _jobs.get(sent_id)
+    if runner is not None:
+        if not runner.sender.paused:
+            return False
+        runner.sender.resume()
+        await runner.checkpoint(status=BroadcastStatus.RUNNING.value)
+        return True
+
+    job = await async_repository.get_broadcast_job(sent_id=sent_id)
+    if job is None or job.status != BroadcastStatus.PAUSED.value:
+        return False
+    await async_repository.update_broadcast_job(
+        sent_id=sent_id, status=BroadcastStatus.RUNNING.value
+    )
+    start(client, job, resumed=True)
+    return True
+
+
+async def cancel(sent_id: str) -> bool:
+    """
+    Cancel a running or paused job, the messages that were sent stay
+    :param sent_id: the sent id
+    :return: False if the job is not running or paused
+    """
+    runner = _jobs.get(sent_id)
+    if runner is not None:
+        runner.sender.cancel()  # the runner saves the status and sends the report
+        return True
+
+    # a paused job, or a running one whose runner stopped without saving its status
+    job = await async_repository.get_broadcast_job(sent_id=sent_id)
+    if job is None or job.status not in (
+        BroadcastStatus.PAUSED.value,
+        BroadcastStatus.RUNNING.value,
+    ):
+        return False
+    await async_repository.update_broadcast_job(
+        sent_id=sent_id, status=BroadcastStatus.CANCELLED.value
+    )
+    return True
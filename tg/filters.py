@@ -4,7 +4,7 @@ import time
 
 from pyrogram import types, filters, enums, Client
 
-from db import repository as db_filters
+from db import async_repository
 from data import config
 
 _logger = logging.getLogger(__name__)
@@ -106,18 +106,16 @@ def create_user() -> filters.Filter:
         tg_id = user.id
         name = user.full_name if user.full_name else ""
 
-        if not db_filters.is_user_exists(tg_id=tg_id):
-            db_filters.create_user(
+        # a cached active user needs nothing, otherwise one upsert creates, refreshes
+        # or reactivates the user (so the profile is refreshed once per cache ttl)
+        cached = async_repository.get_cached_user(tg_id=tg_id)
+        if cached is None or not cached.active:
+            await async_repository.upsert_user(
                 tg_id=tg_id,
                 name=name,
-                admin=False,
                 language_code=user.language_code,
                 username=user.username,
             )
-            return True
-
-        if not db_filters.is_active(tg_id=tg_id):
-            db_filters.update_user(tg_id=tg_id, active=True)
 
         return True
 
@@ -126,7 +124,7 @@ def create_user() -> filters.Filter:
 
 def is_admin() -> filters.Filter:
     async def func(_, __, msg: types.Message) -> bool:
-        return db_filters.is_admin(tg_id=msg.from_user.id)
+        return await async_repository.is_admin(tg_id=msg.from_user.id)
 
     return filters.create(func, name="IsAdmin")
 
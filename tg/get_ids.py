@@ -4,13 +4,17 @@ from typing import Tuple
 from pyrogram import Client, types, enums, errors, raw, ContinuePropagation
 
 from tg import filters, strings, utils
-from db import repository
+from db import async_repository
 from db.repository import StatsType
+from data import cache_memory
 
 
 _logger = logging.getLogger(__name__)
 
+cache = cache_memory.cache_memory
 
+
+@cache.cachable(cache_name="get_reply_markup")
 async def get_reply_markup(client: Client) -> types.InlineKeyboardMarkup:
     return types.InlineKeyboardMarkup(
         [
@@ -46,7 +50,7 @@ async def welcome(_: Client, msg: types.Message):
     user = msg.from_user
     tg_id = user.id
     name = user.full_name if user.full_name else ""
-    lang = repository.get_user_language(tg_id=tg_id)
+    lang = await async_repository.get_user_language(tg_id=tg_id)
 
     await msg.reply_text(
         text=strings.get_text(key="WELCOME", lang=lang).format(name=name),
@@ -106,7 +110,7 @@ async def welcome(_: Client, msg: types.Message):
 async def get_chats_manager(_: Client, msg: types.Message):
     """Get chats manager"""
     tg_id = msg.from_user.id
-    lang = repository.get_user_language(tg_id=tg_id)
+    lang = await async_repository.get_user_language(tg_id=tg_id)
     text = strings.get_text(key="CHAT_MANAGER", lang=lang)
 
     await msg.reply_text(
@@ -150,7 +154,7 @@ async def get_chats_manager(_: Client, msg: types.Message):
 async def choose_lang(_, msg: types.Message):
     """Choose language"""
     tg_id = msg.from_user.id
-    lang = repository.get_user_language(tg_id=tg_id)
+    lang = await async_repository.get_user_language(tg_id=tg_id)
 
     await msg.reply(
         text=strings.get_text(key="CHOICE_LANG", lang=lang),
@@ -172,7 +176,7 @@ async def get_lang(_, query: types.CallbackQuery):
     """Get language"""
     data_lang = query.data.split(":")[1]
     tg_id = query.from_user.id
-    repository.update_user(tg_id=tg_id, lang=data_lang)
+    await async_repository.update_user(tg_id=tg_id, lang=data_lang)
     await query.edit_message_text(
         text=strings.get_text(key="DONE", lang=data_lang).format(data_lang),
     )
@@ -181,7 +185,7 @@ async def get_lang(_, query: types.CallbackQuery):
 async def get_forward(client: Client, msg: types.Message):
     """Get message forward"""
     tg_id = msg.from_user.id
-    lang = repository.get_user_language(tg_id=tg_id)
+    lang = await async_repository.get_user_language(tg_id=tg_id)
     forward = msg.forward_origin
     chat_id = None
 
@@ -226,7 +230,7 @@ async def get_me(client: Client, msg: types.Message):
     """Get id the user"""
     user = msg.from_user
     tg_id = user.id
-    lang = repository.get_user_language(tg_id=tg_id)
+    lang = await async_repository.get_user_language(tg_id=tg_id)
 
     await msg.reply(
         text=strings.get_text(key="ID_USER", lang=lang).format(
@@ -242,7 +246,7 @@ async def get_me(client: Client, msg: types.Message):
 async def get_contact(client: Client, msg: types.Message):
     """Get id from contact"""
     tg_id = msg.from_user.id
-    lang = repository.get_user_language(tg_id=tg_id)
+    lang = await async_repository.get_user_language(tg_id=tg_id)
     chat_id = None
 
     if msg.contact.user_id:
@@ -267,7 +271,7 @@ async def get_contact(client: Client, msg: types.Message):
 async def get_request_peer(client: Client, msg: types.Message):
     """ "Get request peer"""
     tg_id = msg.from_user.id
-    lang = repository.get_user_language(tg_id=tg_id)
+    lang = await async_repository.get_user_language(tg_id=tg_id)
     reply_markup = None
     chat_id = None
 
@@ -295,15 +299,15 @@ async def get_request_peer(client: Client, msg: types.Message):
         if request_chat.request_id == 100:  # support of added to group
             chat = chats[0]
 
-            if not repository.is_group_exists(group_id=chat.id):
-                repository.create_group(
+            if not await async_repository.is_group_exists(group_id=chat.id):
+                await async_repository.create_group(
                     group_id=chat.id,
                     name=chat.title,
                     username=chat.username,
                     added_by_id=tg_id,
                 )
             else:
-                repository.update_group(
+                await async_repository.update_group(
                     group_id=chat.id, added_by_id=tg_id, active=True
                 )
 
@@ -342,7 +346,7 @@ async def get_request_peer(client: Client, msg: types.Message):
 async def get_story(client: Client, msg: types.Message):
     """Get id from story"""
     tg_id = msg.from_user.id
-    lang = repository.get_user_language(tg_id=tg_id)
+    lang = await async_repository.get_user_language(tg_id=tg_id)
     chat = msg.story.chat
 
     if chat.type in [
@@ -373,6 +377,28 @@ async def get_story(client: Client, msg: types.Message):
     utils.create_stats(type_stats=StatsType.STORY, lang=msg.from_user.language_code)
 
 
+@cache.cachable(
+    cache_name="get_chat_by_username",
+    params="username",
+    maxsize=10_000,
+    ttl=10 * 60,
+    single_flight=True,
+    cache_none=True,
+    none_ttl=60,
+)
+async def get_chat_by_username(*, client: Client, username: str) -> types.Chat | None:
+    """
+    Get chat by username, shared by all the users that search the same username
+    :param client: the client
+    :param username: the username, in lower case and without the @
+    :return: :class:`types.Chat`, None if the username is not found
+    """
+    try:
+        return await client.get_chat(username, force_full=False)
+    except errors.BadRequest:  # username not found
+        return None
+
+
 async def get_id_by_username(
     lang: str, client: Client, text: str
 ) -> Tuple[str, int | None]:
@@ -380,9 +406,8 @@ async def get_id_by_username(
     username = filters.get_username(text=text)
     chat_id = None
 
-    try:
-        chat = await client.get_chat(username, force_full=False)
-    except errors.BadRequest:  # username not found
+    chat = await get_chat_by_username(client=client, username=username.lower())
+    if chat is None:  # username not found
         text = strings.get_text(key="CAN_NOT_GET_THE_ID", lang=lang)
 
     else:
@@ -412,7 +437,7 @@ async def get_id_by_username(
 async def get_username_by_message(client: Client, msg: types.Message):
     """Get id from username or link by message"""
     tg_id = msg.from_user.id
-    lang = repository.get_user_language(tg_id=tg_id)
+    lang = await async_repository.get_user_language(tg_id=tg_id)
 
     text, chat_id = await get_id_by_username(lang, client, msg.text)
 
@@ -432,7 +457,7 @@ async def get_username_by_inline_query(client: Client, query: types.InlineQuery)
     Get id by inline query
     """
 
-    lang = repository.get_user_language(tg_id=query.from_user.id)
+    lang = await async_repository.get_user_language(tg_id=query.from_user.id)
 
     text, chat_id = await get_id_by_username(lang, client, query.query)
 
@@ -464,7 +489,7 @@ async def get_via_bot(client: Client, msg: types.Message):
     tg_id = msg.from_user.id
     name = msg.via_bot.first_name
     chat_id = msg.via_bot.id
-    lang = repository.get_user_language(tg_id=chat_id)
+    lang = await async_repository.get_user_language(tg_id=chat_id)
     text = strings.get_text(key="ID_USER", lang=lang).format(name, chat_id)
 
     await msg.reply(
@@ -481,7 +506,7 @@ async def added_to_group(_: Client, msg: types.Message):
     Added the bot to the group
     """
     tg_id = msg.from_user.id
-    lang = repository.get_user_language(tg_id=tg_id)
+    lang = await async_repository.get_user_language(tg_id=tg_id)
 
     await msg.reply(
         text=strings.get_text(key="ADD_BOT_TO_GROUP", lang=lang),
@@ -525,11 +550,11 @@ async def on_remove_permission(_: Client, update: types.ChatMemberUpdated):
             update.old_chat_member.status == enums.ChatMemberStatus.MEMBER
             and update.new_chat_member.status == enums.ChatMemberStatus.BANNED
         ):
-            if repository.is_user_exists(tg_id=update.from_user.id):
+            if await async_repository.is_user_exists(tg_id=update.from_user.id):
                 _logger.debug(
                     f"The bot has been stopped by the user: {update.from_user.id}, {update.from_user.first_name}"
                 )
-                repository.update_user(tg_id=update.from_user.id, active=False)
+                await async_repository.update_user(tg_id=update.from_user.id, active=False)
             return
 
     # the bot has had permissions removed from a chat
@@ -545,7 +570,7 @@ async def on_remove_permission(_: Client, update: types.ChatMemberUpdated):
         _logger.debug(
             f"The bot has had permissions removed from: {update.chat.id}, {update.chat.title}"
         )
-        repository.update_group(group_id=update.chat.id, active=False)
+        await async_repository.update_group(group_id=update.chat.id, active=False)
 
 
 async def get_id_by_reply_to_another_chat(
@@ -661,7 +686,7 @@ async def get_id_by_reply(msg: types.Message) -> str | tuple[int, str]:
 
     if msg.chat.type == enums.ChatType.PRIVATE:
         tg_id = msg.from_user.id
-        lang = repository.get_user_language(tg_id=tg_id)
+        lang = await async_repository.get_user_language(tg_id=tg_id)
 
     if msg.reply_to_story:
         return await get_id_by_reply_to_story(lang, msg)
@@ -693,15 +718,14 @@ async def get_ids_in_the_group(client: Client, msg: types.Message):
     if filters.is_mention_users(msg):  # get is mention users
         for entity in msg.entities:
             if entity.type == enums.MessageEntityType.MENTION:
-                try:
-                    username = msg.text[entity.offset : entity.offset + entity.length]
-                    user = await client.get_chat(username, force_full=False)
+                username = msg.text[entity.offset : entity.offset + entity.length]
+                user = await get_chat_by_username(
+                    client=client, username=username.lstrip("@").lower()
+                )
+                if user is not None:
                     name = user.full_name if user.full_name else ""
                     chat_id = user.id
-                except errors.BadRequest:
-                    break
-                else:
-                    break
+                break
             elif entity.type == enums.MessageEntityType.TEXT_MENTION:
                 chat_id = entity.user.id
                 name = (
@@ -735,7 +759,7 @@ async def get_reply_to_another_chat(_: Client, msg: types.Message):
     get reply to another chat
     """
     tg_id = msg.from_user.id
-    lang = repository.get_user_language(tg_id=tg_id)
+    lang = await async_repository.get_user_language(tg_id=tg_id)
 
     text = await get_id_by_reply_to_another_chat(lang, msg)
 
@@ -772,7 +796,7 @@ async def get_id_by_manage_business(_: Client, msg: types.Message):
     Get id by manage business.
     """
 
-    lang = repository.get_user_language(tg_id=msg.from_user.id)
+    lang = await async_repository.get_user_language(tg_id=msg.from_user.id)
     from_chat_id = msg.text.split("bizChat")[1]
     try:
         from_chat_id = int(from_chat_id)
@@ -796,23 +820,23 @@ async def handle_business_connection(
     Handle business connection and disconnection
     """
     try:
-        if not repository.is_user_exists(tg_id=update.connection.user_id):
+        if not await async_repository.is_user_exists(tg_id=update.connection.user_id):
             user = users.get(update.connection.user_id)
-            repository.create_user(
+            await async_repository.create_user(
                 tg_id=user.id,
                 name=user.first_name,
                 username=user.username,
                 language_code=user.language_code,
             )
         else:
-            if not repository.is_active(tg_id=update.connection.user_id):
-                repository.update_user(tg_id=update.connection.user_id, active=True)
+            if not await async_repository.is_active(tg_id=update.connection.user_id):
+                await async_repository.update_user(tg_id=update.connection.user_id, active=True)
 
-        lang = repository.get_user_language(tg_id=update.connection.user_id)
+        lang = await async_repository.get_user_language(tg_id=update.connection.user_id)
 
         if not update.connection.disabled:  # user add the bot to our business
             if update.connection.can_reply:
-                repository.update_user(
+                await async_repository.update_user(
                     tg_id=update.connection.user_id,
                     business_id=update.connection.connection_id,
                 )
@@ -832,7 +856,7 @@ async def handle_business_connection(
                 )
 
         else:  # user remove the bot from our business
-            repository.update_user(tg_id=update.connection.user_id, business_id=None)
+            await async_repository.update_user(tg_id=update.connection.user_id, business_id=None)
 
             await client.send_message(
                 chat_id=update.connection.user_id,
@@ -848,7 +872,7 @@ async def handle_business_connection(
 async def send_link_to_chat_by_id(_: Client, msg: types.Message):
     """Send link to chat by id"""
     tg_id = msg.from_user.id
-    lang = repository.get_user_language(tg_id=tg_id)
+    lang = await async_repository.get_user_language(tg_id=tg_id)
 
     try:
         _, chat_id = msg.text.split(" ", 1)
@@ -899,7 +923,7 @@ async def send_link_to_chat_by_id(_: Client, msg: types.Message):
 async def send_about(_: Client, msg: types.Message):
     """Send info about the bot"""
     tg_id = msg.from_user.id
-    lang = repository.get_user_language(tg_id=tg_id)
+    lang = await async_repository.get_user_language(tg_id=tg_id)
 
     await msg.reply_text(
         text=strings.get_text(key="INFO_ABOUT", lang=lang),
@@ -227,6 +227,24 @@ HANDLERS = [
         & tg_filters.create_user()
         & tg_filters.is_admin(),
     ),
+    handlers.MessageHandler(
+        admin_command.cache_stats,
+        filters.private
+        & ~filters.tg_business
+        & filters.command("cache")
+        & tg_filters.is_user_spamming()
+        & tg_filters.create_user()
+        & tg_filters.is_admin(),
+    ),
+    handlers.MessageHandler(
+        admin_command.usage,
+        filters.private
+        & ~filters.tg_business
+        & filters.command("usage")
+        & tg_filters.is_user_spamming()
+        & tg_filters.create_user()
+        & tg_filters.is_admin(),
+    ),
     handlers.MessageHandler(
         admin_command.ask_for_who_to_send,
         filters.private
@@ -243,6 +261,13 @@ HANDLERS = [
         & tg_filters.create_user()
         & tg_filters.is_admin(),
     ),
+    handlers.MessageHandler(
+        admin_command.control_broadcast,
+        filters.command(["pause", "resume", "cancel"])
+        & ~filters.tg_business
+        & tg_filters.create_user()
+        & tg_filters.is_admin(),
+    ),
     handlers.CallbackQueryHandler(
         admin_command.asq_message_for_subscribe,
         filters.create(lambda _, __, msg: msg.data.startswith("send"))
@@ -2,7 +2,7 @@ import logging
 from pyrogram import types, Client, errors
 
 from data import cache_memory
-from db import repository
+from db import repository, async_repository
 from tg import strings
 
 
@@ -18,8 +18,14 @@ list_of_help: list[list[str]] = [
 ]
 
 
-@cache.cachable(cache_name="get_keyboard", params=("keyboard_from", "tg_id"))
-def get_keyboard(
+@cache.cachable(
+    cache_name="get_keyboard",
+    params=("keyboard_from", "tg_id"),
+    maxsize=repository.USER_CACHE_MAXSIZE,
+    ttl=repository.USER_CACHE_TTL,
+    tags=repository.USER_CACHE_TAG,  # the keyboard is in the language of the user
+)
+async def get_keyboard(
     *, keyboard_from: str | list, tg_id: int
 ) -> list[list[types.InlineKeyboardButton]]:
     """
@@ -28,7 +34,7 @@ def get_keyboard(
     :param tg_id: int
     :return: list[list[types.InlineKeyboardButton]]
     """
-    lang = repository.get_user_language(tg_id=tg_id)
+    lang = await async_repository.get_user_language(tg_id=tg_id)
     list_of_keyboard = []
 
     for lst in list_of_help:
@@ -108,10 +114,10 @@ def get_back_callback_data(data_index_lst: int, data_index_item: int) -> str:
     return f"help:back:{data_index_lst}-{data_index_item}:{index_lst}:{index_item}"
 
 
-def get_keyboard_menu(
+async def get_keyboard_menu(
     keyboard_from: str | list, tg_id: int
 ) -> types.InlineKeyboardMarkup:
-    lang = repository.get_user_language(tg_id=tg_id)
+    lang = await async_repository.get_user_language(tg_id=tg_id)
     return types.InlineKeyboardMarkup(
         [
             [
@@ -120,7 +126,7 @@ def get_keyboard_menu(
                     callback_data=f"help:next:{keyboard_from}:0:0",
                 )
             ],
-            *get_keyboard(keyboard_from=keyboard_from, tg_id=tg_id),
+            *await get_keyboard(keyboard_from=keyboard_from, tg_id=tg_id),
             [
                 types.InlineKeyboardButton(
                     text=strings.get_text(key="ABOUT", lang=lang),
@@ -136,12 +142,12 @@ async def handle_callback_data_help(
     _: Client, cbd: types.CallbackQuery | types.Message
 ):
     tg_id = cbd.from_user.id
-    lang = repository.get_user_language(tg_id=tg_id)
+    lang = await async_repository.get_user_language(tg_id=tg_id)
 
     if isinstance(cbd, types.Message):
         await cbd.reply(
             text=strings.get_text(key="INFO_MENU", lang=lang),
-            reply_markup=get_keyboard_menu(keyboard_from="menu", tg_id=tg_id),
+            reply_markup=await get_keyboard_menu(keyboard_from="menu", tg_id=tg_id),
         )
 
     else:
@@ -201,7 +207,7 @@ async def handle_callback_data_help(
             elif data[1] == "menu":
                 await cbd.edit_message_text(
                     text=strings.get_text(key="INFO_MENU", lang=lang),
-                    reply_markup=get_keyboard_menu(keyboad_from, tg_id),
+                    reply_markup=await get_keyboard_menu(keyboad_from, tg_id),
                 )
 
             elif data[1] == "info":
@@ -237,7 +243,7 @@ async def handle_callback_data_help(
                             key=f"INFO_{get_item_from_callback_data(index_lst, index_item).upper()}",
                             lang=lang,
                         ),
-                        reply_markup=get_keyboard_menu(
+                        reply_markup=await get_keyboard_menu(
                             keyboard_from=str(keyboad_from), tg_id=tg_id
                         ),
                     )
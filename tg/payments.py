@@ -2,7 +2,7 @@ import logging
 from pyrogram import Client, types
 
 from tg import strings
-from db import repository
+from db import async_repository
 from data import config
 
 _logger = logging.getLogger(__name__)
@@ -12,7 +12,7 @@ settings = config.get_settings()
 
 async def ask_for_payment(_: Client, msg: types.Message):
     tg_id = msg.from_user.id
-    lang = repository.get_user_language(tg_id=tg_id)
+    lang = await async_repository.get_user_language(tg_id=tg_id)
 
     await msg.reply_text(
         text=strings.get_text(key="ASK_AMOUNT_TO_PAY", lang=lang),
@@ -55,7 +55,7 @@ async def ask_for_payment(_: Client, msg: types.Message):
 
 async def send_payment(_: Client, cbd: types.CallbackQuery):
     tg_id = cbd.from_user.id
-    lang = repository.get_user_language(tg_id=tg_id)
+    lang = await async_repository.get_user_language(tg_id=tg_id)
     amount = int(cbd.data.split(":")[1])
 
     await cbd.message.reply_invoice(
@@ -83,7 +83,7 @@ async def send_thanks_for_support(client: Client, msg: types.Message):
     send message to user that payment is successful, and thank you for support...
     """
     tg_id = msg.from_user.id
-    lang = repository.get_user_language(tg_id=tg_id)
+    lang = await async_repository.get_user_language(tg_id=tg_id)
     payment = msg.successful_payment
 
     await msg.reply_text(
@@ -0,0 +1,147 @@
+# this file contains the progress reporter: the status message of a long task (a broadcast,
+# a /delete) is edited in the background at most once every few seconds with the latest counters
+
+import asyncio
+import logging
+import time
+
+from pyrogram import types, errors
+
+from data import config
+
+
+_logger = logging.getLogger(__name__)
+
+settings = config.get_settings()
+
+
+def format_duration(seconds: float) -> str:
+    """
+    Format seconds like 1h 5m, 3m 20s or 45s
+    :param seconds: the seconds
+    :return: str
+    """
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return f"{hours}h {minutes}m"
+    if minutes:
+        return f"{minutes}m {seconds}s"
+    return f"{seconds}s"
+
+
+class ProgressReporter:
+    """
+    Show the progress of a task in one status message. The counters are updated on every
+    step, and the message is edited every ``interval`` seconds with the latest of them, only
+    if they changed, so the steps in between cost no edits.
+    """
+
+    def __init__(
+        self,
+        *,
+        title: str,
+        total: int,
+        done_label: str = "Sent",
+        done: int = 0,
+        failed: int = 0,
+        interval: float = settings.progress_interval,
+    ):
+        """
+        :param title: the first line of the message
+        :param total: the number of steps of the task
+        :param done_label: the name of the done steps, like Sent or Deleted
+        :param done: the steps that were done before, by a previous run of the task
+        :param failed: the steps that failed before
+        :param interval: the minimum seconds between two edits
+        """
+        self.title = title
+        self.total = total
+        self.done_label = done_label
+        self.done = done
+        self.failed = failed
+        self._interval = interval
+        self._started_at = time.monotonic()
+        self._started_with = done + failed  # the rate counts only the steps of this run
+        self._message: types.Message | None = None
+        self._shown: tuple[int, int] | None = None
+        self._task: asyncio.Task | None = None
+
+    def update(self, *, done: int, failed: int):
+        """
+        Set the latest counters, they are shown on the next edit
+        :param done: the steps that were done
+        :param failed: the steps that failed
+        """
+        self.done = done
+        self.failed = failed
+
+    @property
+    def rate(self) -> float:
+        """The steps per second of this run"""
+        elapsed = time.monotonic() - self._started_at
+        steps = self.done + self.failed - self._started_with
+        return steps / elapsed if elapsed > 0 else 0.0
+
+    def render(self, *, note: str | None = None) -> str:
+        """
+        The text of the message with the current counters
+        :param note: the last line instead of the ETA, like the end of the task
+        """
+        steps = self.done + self.failed
+        percent = steps * 100 // self.total if self.total else 100
+        rate = self.rate
+        if note is None:
+            if rate > 0:
+                eta = format_duration(max(0, self.total - steps) / rate)
+            else:
+                eta = "unknown"
+            note = f"ETA: {eta}"
+        return (
+            f"**{self.title}**\n\n"
+            f"{self.done_label}: {self.done} of {self.total} ({percent}%)\n"
+            f"Failed: {self.failed}\n"
+            f"Rate: {rate:.1f}/s\n"
+            f"{note}"
+        )
+
+    async def _edit(self, text: str):
+        try:
+            await self._message.edit_text(text)
+        except errors.MessageNotModified:
+            pass
+        except errors.FloodWait as e:
+            # the next edit is in interval seconds anyway, the sends need the flood budget more
+            _logger.warning(f"FloodWait of {e.value} s on the progress of {self.title}")
+        except Exception:  # noqa, the progress must not stop the task
+            _logger.exception(f"Failed to edit the progress of {self.title}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            counters = (self.done, self.failed)
+            if counters != self._shown:
+                self._shown = counters
+                await self._edit(self.render())
+
+    def start(self, message: types.Message):
+        """
+        Start editing the message in the background
+        :param message: the status message, sent with the text of :meth:`render`
+        """
+        self._message = message
+        self._started_at = time.monotonic()
+        self._shown = (self.done, self.failed)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, *, note: str):
+        """
+        Stop editing, and edit the message one last time
+        :param note: the last line, like the end of the task
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._message is not None:
+            await self._edit(self.render(note=note))
@@ -1,17 +1,12 @@
 import logging
-import threading
 
-from db import repository, tables
+from db import tables
+from db.stats_writer import stats_writer
 
 _logger = logging.getLogger(__name__)
 
 
 def create_stats(type_stats: tables.StatsType, lang: str):
-    """Create stats"""
+    """Create stats, the row is written in the background by the stats writer"""
 
-    schedule_tread = threading.Thread(
-        target=repository.create_stats,
-        kwargs=dict(type_stats=type_stats, lang=lang),
-        daemon=True,
-    )
-    schedule_tread.start()
+    stats_writer.put(type_stats=type_stats, lang=lang)